@@ -0,0 +1,99 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy
+import pandas
+from pydantic import BaseModel
+
+from headwind.locking import atomic_write
+from headwind.spec import Metric, Run
+
+
+class MetricInfo(BaseModel):
+    name: str
+    group: Optional[str]
+    unit: str
+    first_commit: str
+    last_commit: str
+    num_runs: int = 0
+
+    def to_metric(self) -> Metric:
+        return Metric(name=self.name, group=self.group, unit=self.unit, value=None)
+
+
+class MetricCatalog:
+    """
+    Every metric ever stored, with the first and last commit it was seen on
+    and the number of runs that contain it. Kept up to date on every
+    ``store_run`` so listing metrics does not require reading the history.
+    """
+
+    file: Path
+
+    def __init__(self, file: Path) -> None:
+        self.file = file
+
+    def exists(self) -> bool:
+        return self.file.exists()
+
+    def load(self) -> Dict[str, MetricInfo]:
+        if not self.exists():
+            return {}
+        with self.file.open("r") as fh:
+            return {m["name"]: MetricInfo.construct(**m) for m in json.load(fh)}
+
+    def write(self, metrics: Dict[str, MetricInfo]) -> None:
+        atomic_write(
+            self.file, json.dumps([m.dict() for m in metrics.values()], indent=2)
+        )
+
+    def add_run(self, run: Run) -> None:
+        self.add_runs([run])
+
+    def add_runs(self, runs: Iterable[Run]) -> None:
+        metrics = self.load()
+        for run in runs:
+            for m in run.results:
+                info = metrics.get(m.name)
+                if info is None:
+                    info = MetricInfo(
+                        name=m.name,
+                        group=m.group,
+                        unit=m.unit,
+                        first_commit=run.commit.hash,
+                        last_commit=run.commit.hash,
+                    )
+                    metrics[m.name] = info
+                info.group = m.group
+                info.unit = m.unit
+                info.last_commit = run.commit.hash
+                info.num_runs += 1
+        self.write(metrics)
+
+    @staticmethod
+    def from_columns(
+        data: Dict[str, numpy.ndarray], metrics: List[Metric]
+    ) -> Dict[str, MetricInfo]:
+        """
+        Build the catalog content from the column store, ordering the runs by
+        commit date.
+        """
+        dates = pandas.to_datetime(data["date"], utc=True, format="ISO8601")
+        order = numpy.argsort(dates.to_numpy(), kind="stable")
+        commits = data["commit"][order]
+
+        out = {}
+        for m in metrics:
+            present = numpy.flatnonzero(~numpy.isnan(data[m.name][order]))
+            if len(present) == 0:
+                continue
+            out[m.name] = MetricInfo(
+                name=m.name,
+                group=m.group,
+                unit=m.unit,
+                first_commit=str(commits[present[0]]),
+                last_commit=str(commits[present[-1]]),
+                num_runs=len(present),
+            )
+        return out
@@ -1,5 +1,8 @@
+import contextlib
 from datetime import datetime
+import os
 from pathlib import Path
+from typing import ContextManager, Optional
 
 import typer
 from headwind.collector import CollectorError, run_collectors
@@ -9,28 +12,71 @@ from headwind.git import (
     get_current_commit,
     get_branch,
 )
-from headwind.storage import Storage
+from headwind.storage import open_storage
+from headwind.segment_storage import SegmentStorage
 from headwind.test import generate_dummy_data
 from headwind.spec import load_spec, Run, Commit
-from headwind.report import make_report
+from headwind.report import RenderMode, make_report
+from headwind.retention import plan_retention
+from headwind.timing import Timings, record, timed
+from headwind.transfer import ExportFormat, export_runs, import_runs, read_runs
 
 from wasabi import msg
 
 app = typer.Typer(add_completion=False)
 
+TIMINGS_HELP = "Print wall and CPU time per phase, page and collector"
+PROFILE_HELP = "Also write the timings to this file as a Chrome trace"
+
+
+def _recording(timings: bool, profile: Optional[Path]) -> ContextManager:
+    if timings or profile is not None:
+        return record()
+    return contextlib.nullcontext()
+
+
+def _report_timings(timings: Timings, profile: Optional[Path], limit: int = 30) -> None:
+    rows = timings.summary()
+    msg.table(
+        [
+            (category, name, n, f"{wall:.3f}", f"{cpu:.3f}", f"{longest:.3f}")
+            for category, name, n, wall, cpu, longest in rows[:limit]
+        ],
+        header=("Category", "Name", "Count", "Wall [s]", "CPU [s]", "Max [s]"),
+        divider=True,
+    )
+    if len(rows) > limit:
+        msg.info(f"{len(rows) - limit} more, see the trace for all of them")
+    if profile is not None:
+        timings.write_trace(profile)
+        msg.good(f"Trace written to {profile}")
+
 
 @app.command()
 def publish(
     spec_file: typer.FileText,
     output: Path,
+    jobs: int = typer.Option(os.cpu_count() or 1, "--jobs", "-j"),
+    force: bool = typer.Option(False, "--force", help="Render all pages again"),
+    render_mode: RenderMode = typer.Option(RenderMode.Processes, "--render"),
+    timings: bool = typer.Option(False, "--timings", help=TIMINGS_HELP),
+    profile: Optional[Path] = typer.Option(None, "--profile", help=PROFILE_HELP),
 ) -> None:
     spec = load_spec(spec_file)
-    storage = Storage(spec.storage_dir)
+    storage = open_storage(spec)
 
     if not output.exists():
         output.mkdir(parents=True)
 
-    make_report(spec, storage, output)
+    assert jobs > 0, "Jobs value must be positive"
+
+    with _recording(timings, profile) as recorded:
+        with timed("publish"):
+            make_report(
+                spec, storage, output, jobs=jobs, force=force, render_mode=render_mode
+            )
+    if recorded is not None:
+        _report_timings(recorded, profile)
 
 
 @app.command("list")
@@ -38,13 +84,14 @@ def do_list(
     spec_file: typer.FileText,
 ) -> None:
     spec = load_spec(spec_file)
-    storage = Storage(spec.storage_dir)
+    storage = open_storage(spec)
 
-    tips = storage.find_branch_tips()
-    for key, tip in tips.items():
-        print(key)
-        for i in storage.iterate(tip):
-            print("-", i.commit.hash[:8], i.commit.date, i.commit.message)
+    with storage.synced():
+        tips = storage.find_branch_tips()
+        for key, tip in tips.items():
+            print(key)
+            for i in storage.iterate(tip):
+                print("-", i.commit.hash[:8], i.commit.date, i.commit.message)
 
 
 @app.command("collect")
@@ -55,9 +102,11 @@ def collect_cmd(
         get_current_commit().hash, "--commit", show_default=True
     ),
     branch: str = typer.Option(get_branch(), "--branch", show_default=True),
+    timings: bool = typer.Option(False, "--timings", help=TIMINGS_HELP),
+    profile: Optional[Path] = typer.Option(None, "--profile", help=PROFILE_HELP),
 ) -> None:
     spec = load_spec(spec_file)
-    storage = Storage(spec.storage_dir)
+    storage = open_storage(spec)
 
     commit = Commit(
         hash=str(commit_in),
@@ -83,33 +132,162 @@ def collect_cmd(
     msg.good("Spec loaded successfully")
     msg.divider()
 
-    try:
-        results = run_collectors(spec.collectors, jobs=jobs)
-    except CollectorError as e:
-        msg.fail("Collector returned invalid format")
-        typer.echo(str(e.exc))
+    with _recording(timings, profile) as recorded:
+        try:
+            with timed("collect"):
+                results = run_collectors(spec.collectors, jobs=jobs)
+        except CollectorError as e:
+            msg.fail("Collector returned invalid format")
+            typer.echo(str(e.exc))
+            return
+            # raise e
+
+        msg.good("Collection completed")
+        # print(results)
+
+        run = Run(
+            commit=commit,
+            parent=parent,
+            branch=branch,
+            date=datetime.now(),
+            results=sum((r.metrics for r in results), []),
+            context={},
+        )
+
+        # print(run)
+
+        storage = open_storage(spec)
+
+        with timed("store run"):
+            storage.store_run(run)
+
+    if recorded is not None:
+        _report_timings(recorded, profile)
+
+    # for result in results:
+
+
+@app.command()
+def metrics(spec_file: typer.FileText) -> None:
+    spec = load_spec(spec_file)
+    storage = open_storage(spec)
+
+    catalog = sorted(
+        storage.catalog().values(), key=lambda m: (m.group or "other", m.name)
+    )
+    msg.table(
+        [
+            (
+                m.group or "other",
+                m.name,
+                m.unit,
+                m.num_runs,
+                m.first_commit[:8],
+                m.last_commit[:8],
+            )
+            for m in catalog
+        ],
+        header=("Group", "Name", "Unit", "Runs", "First", "Last"),
+        divider=True,
+    )
+
+
+@app.command()
+def compact(spec_file: typer.FileText) -> None:
+    spec = load_spec(spec_file)
+    storage = open_storage(spec)
+
+    if not isinstance(storage, SegmentStorage):
+        msg.warn(f"Storage backend '{spec.storage_backend.value}' needs no compaction")
         return
-        # raise e
-
-    msg.good("Collection completed")
-    # print(results)
-
-    run = Run(
-        commit=commit,
-        parent=parent,
-        branch=branch,
-        date=datetime.now(),
-        results=sum((r.metrics for r in results), []),
-        context={},
+
+    num_segments = len(storage._segments())
+    dropped = storage.compact()
+    msg.good(
+        f"Compacted {num_segments} segment(s) into {len(storage._segments())},"
+        f" dropped {dropped} superseded run(s)"
     )
 
-    # print(run)
 
-    storage = Storage(spec.storage_dir)
+@app.command()
+def migrate(spec_file: typer.FileText) -> None:
+    spec = load_spec(spec_file)
+    storage = open_storage(spec)
 
-    storage.store_run(run)
+    n = storage.migrate()
+    msg.good(
+        f"Migrated {n} run(s) to compression '{spec.storage_compression.value}'"
+        f" and layout '{spec.storage_layout.value}'"
+    )
 
-    # for result in results:
+
+@app.command("export")
+def export_cmd(
+    spec_file: typer.FileText,
+    output: Path,
+    fmt: Optional[ExportFormat] = typer.Option(None, "--format"),
+    chunk_size: int = typer.Option(10000, "--chunk-size"),
+) -> None:
+    spec = load_spec(spec_file)
+    storage = open_storage(spec)
+
+    if fmt is None:
+        try:
+            fmt = ExportFormat.from_path(output)
+        except ValueError:
+            msg.fail(f"Cannot tell the format of {output}, use --format")
+            raise typer.Exit(1)
+
+    assert chunk_size > 0, "Chunk size must be positive"
+
+    try:
+        n = export_runs(storage, output, fmt, chunk_size=chunk_size)
+    except ImportError as e:
+        msg.fail(str(e))
+        raise typer.Exit(1)
+    msg.good(f"Exported {n} run(s) to {output}")
+
+
+@app.command("import")
+def import_cmd(spec_file: typer.FileText, input_file: typer.FileText) -> None:
+    spec = load_spec(spec_file)
+    storage = open_storage(spec)
+
+    imported, skipped = import_runs(storage, read_runs(input_file))
+    msg.good(f"Imported {imported} run(s), skipped {skipped} already stored")
+
+
+@app.command()
+def gc(
+    spec_file: typer.FileText,
+    dry_run: bool = typer.Option(False, "--dry-run"),
+) -> None:
+    spec = load_spec(spec_file)
+    storage = open_storage(spec)
+
+    if spec.retention is None:
+        msg.warn("No retention policy in spec, nothing to do")
+        return
+
+    num_runs = storage.num_runs()
+    if dry_run:
+        tips = {b: c.hash for b, c in storage.find_branch_tips().items()}
+        plan = plan_retention(storage.graph(), tips, spec.retention)
+    else:
+        # planned again under the storage lock, runs stored meanwhile are kept
+        plan = storage.gc(spec.retention)
+
+    msg.info(
+        f"Dropping {len(plan.drop)} of {num_runs} run(s),"
+        f" {len(plan.branches)} branch(es), relinking {len(plan.reparent)} run(s)"
+    )
+    for branch in plan.branches:
+        print("-", branch)
+
+    if dry_run or not plan:
+        return
+
+    msg.good("Retention policy applied")
 
 
 @app.command()
@@ -117,7 +295,7 @@ def make_test_data(spec_file: typer.FileText, n: int = typer.Option(1, "-n")):
     runs = generate_dummy_data(42, n, ["main", "feature_a", "feature_b"])
 
     spec = load_spec(spec_file)
-    storage = Storage(spec.storage_dir)
+    storage = open_storage(spec)
 
     for run in runs:
         storage.store_run(run)
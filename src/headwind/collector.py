@@ -1,3 +1,4 @@
+import contextvars
 import subprocess
 from concurrent.futures import wait
 from typing import List, cast
@@ -6,6 +7,7 @@ import pydantic
 from headwind.executor import make_executor
 
 from headwind.spec import CollectorModel, CollectorType, CollectorResult
+from headwind.timing import timed
 
 
 class CollectorError(BaseException):
@@ -23,11 +25,13 @@ def run_collector(model: CollectorModel) -> CollectorResult:
         # result = subprocess.run(
         #     model.arg, shell=True, capture_output=True, encoding="utf-8"
         # ).stdout
-        result = subprocess.check_output(model.arg, shell=True, encoding="utf-8")
+        with timed(model.arg, "collector"):
+            result = subprocess.check_output(model.arg, shell=True, encoding="utf-8")
         # print("Raw result:")
         # print(result)
         try:
-            return cast(CollectorResult, CollectorResult.parse_raw(result))
+            with timed("parse result", "step"):
+                return cast(CollectorResult, CollectorResult.parse_raw(result))
         except pydantic.error_wrappers.ValidationError as e:
             raise CollectorError(e)
 
@@ -36,7 +40,11 @@ def run_collectors(
     collectors: List[CollectorModel], jobs: int
 ) -> List[CollectorResult]:
     with make_executor(jobs) as ex:
-        fs = [ex.submit(run_collector, c) for c in collectors]
+        # in a copy of this context, so timings are recorded in threads too
+        fs = [
+            ex.submit(contextvars.copy_context().run, run_collector, c)
+            for c in collectors
+        ]
         wait(fs)
         results = [f.result() for f in fs]
 
@@ -0,0 +1,465 @@
+import io
+import json
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, cast
+
+import numpy
+
+from headwind.locking import atomic_write
+from headwind.spec import Metric, Run
+
+KEY_COLUMNS = ("commit", "parent", "branch", "date", "message")
+# free text of any length, not stored as fixed width arrays
+TEXT_COLUMNS = ("message",)
+# more chunks than this are merged even if they are unevenly sized
+MAX_CHUNKS = 32
+
+
+class TextColumn:
+    """
+    Read-only column of strings, stored per chunk as one UTF-8 buffer and the
+    offsets of the rows in it, so long values do not pad every other row.
+    Only the rows that are indexed are decoded.
+    """
+
+    def __init__(self, parts: List[Tuple[numpy.ndarray, numpy.ndarray]]) -> None:
+        # (buffer, offsets) per chunk, with one more offset than rows
+        self._parts = parts
+        self._starts = numpy.cumsum([0] + [len(offsets) - 1 for _, offsets in parts])
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def __getitem__(self, rows: Any) -> numpy.ndarray:
+        rows = numpy.arange(len(self))[rows]
+        out = numpy.empty(len(rows), dtype=object)
+        parts = numpy.searchsorted(self._starts, rows, side="right") - 1
+        for i, (row, part) in enumerate(zip(rows, parts)):
+            buffer, offsets = self._parts[part]
+            j = row - self._starts[part]
+            out[i] = buffer[offsets[j] : offsets[j + 1]].tobytes().decode("utf8")
+        return out
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> numpy.ndarray:
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+
+class ColumnStore:
+    """
+    Columnar copy of the run history, so the wide frame can be assembled
+    without parsing the individual runs again. Rows are kept in chunks: every
+    update appends a chunk, and the newest chunks are merged while they are
+    at least as large as the one before, so a row is rewritten a logarithmic
+    number of times. Within a chunk, every key column is one ``.npy`` array,
+    messages are a UTF-8 buffer with offsets, and the metrics are the columns
+    of one column-major ``values.npy``.
+    """
+
+    base_dir: Path
+
+    def __init__(self, base_dir: Path) -> None:
+        self.base_dir = base_dir
+
+    @property
+    def _meta_file(self) -> Path:
+        return self.base_dir / "columns.json"
+
+    @property
+    def _chunks_dir(self) -> Path:
+        return self.base_dir / "chunks"
+
+    def _read_json(self, path: Path) -> Optional[Dict[str, Any]]:
+        if not path.exists():
+            return None
+        with path.open("r") as fh:
+            return json.load(fh)  # type: ignore
+
+    def exists(self) -> bool:
+        # stores from before the chunked layout are rebuilt from the runs
+        meta = self._read_json(self._meta_file)
+        return meta is not None and "chunks" in meta
+
+    def _read_meta(self) -> Dict[str, Any]:
+        meta = self._read_json(self._meta_file)
+        if meta is None or "chunks" not in meta:
+            return {"num_rows": 0, "metrics": [], "chunks": [], "next_chunk": 0}
+        return meta
+
+    def num_rows(self) -> int:
+        return int(self._read_meta()["num_rows"])
+
+    def metrics(self) -> List[Metric]:
+        return [
+            Metric(name=m["name"], group=m["group"], unit=m["unit"], value=None)
+            for m in self._read_meta()["metrics"]
+        ]
+
+    def load(
+        self,
+        columns: Iterable[str] = KEY_COLUMNS,
+        metrics: Optional[Iterable[str]] = None,
+        mmap: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Load the requested key columns and metric arrays. If ``metrics`` is
+        ``None``, all metrics are loaded. With ``mmap``, arrays are memory
+        mapped, and only the rows that are indexed later are read. Messages
+        are returned as a :class:`TextColumn`.
+        """
+        meta = self._read_meta()
+        chunks = meta["chunks"]
+        out: Dict[str, Any] = {}
+        for name in columns:
+            assert name in KEY_COLUMNS, f"Unknown column {name}"
+            if name in TEXT_COLUMNS:
+                out[name] = TextColumn([self._load_text(c, name, mmap) for c in chunks])
+            else:
+                out[name] = _concat(
+                    [
+                        self._load_array(self._chunk_dir(c) / f"{name}.npy", mmap)
+                        for c in chunks
+                    ],
+                    str,
+                )
+
+        known = [m["name"] for m in meta["metrics"]]
+        names = known if metrics is None else list(metrics)
+        for name in names:
+            if name not in known:
+                raise KeyError(f"Unknown metric {name}")
+        if not names:
+            # key columns only, the values are not read at all
+            return out
+        values = [self._load_values(c, mmap) for c in chunks]
+        for name in names:
+            out[name] = _concat(
+                [
+                    v.get(name, numpy.full(c["num_rows"], numpy.nan))
+                    for c, v in zip(chunks, values)
+                ],
+                float,
+            )
+        return out
+
+    def iterate_rows(
+        self, metrics: List[str], chunk_size: int
+    ) -> Iterator[Dict[str, numpy.ndarray]]:
+        """
+        The key columns and ``metrics`` of all rows, in storage order, at most
+        ``chunk_size`` rows at a time. The files are memory mapped before the
+        first rows are returned, so later updates of the store do not affect
+        the iteration, and only the returned rows are read.
+        """
+        meta = self._read_meta()
+        known = {m["name"] for m in meta["metrics"]}
+        for name in metrics:
+            if name not in known:
+                raise KeyError(f"Unknown metric {name}")
+
+        opened = []
+        for chunk in meta["chunks"]:
+            keys = {
+                name: (
+                    TextColumn([self._load_text(chunk, name, True)])
+                    if name in TEXT_COLUMNS
+                    else self._load_array(self._chunk_dir(chunk) / f"{name}.npy", True)
+                )
+                for name in KEY_COLUMNS
+            }
+            opened.append((chunk["num_rows"], keys, self._load_values(chunk, True)))
+        return _iterate_rows(opened, metrics, chunk_size)
+
+    def _chunk_dir(self, chunk: Dict[str, Any]) -> Path:
+        return self._chunks_dir / str(chunk["name"])
+
+    @staticmethod
+    def _load_array(path: Path, mmap: bool = False) -> numpy.ndarray:
+        return cast(
+            numpy.ndarray,
+            numpy.load(path, mmap_mode="r" if mmap else None, allow_pickle=False),
+        )
+
+    def _load_text(
+        self, chunk: Dict[str, Any], name: str, mmap: bool
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        path = self._chunk_dir(chunk) / f"{name}.bin"
+        buffer: numpy.ndarray
+        if mmap and path.stat().st_size > 0:
+            buffer = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+        else:
+            buffer = numpy.fromfile(path, dtype=numpy.uint8)
+        offsets = self._load_array(self._chunk_dir(chunk) / f"{name}.offsets.npy", mmap)
+        return buffer, offsets
+
+    def _load_values(
+        self, chunk: Dict[str, Any], mmap: bool
+    ) -> Dict[str, numpy.ndarray]:
+        values = self._load_array(self._chunk_dir(chunk) / "values.npy", mmap)
+        return {name: values[:, j] for j, name in enumerate(chunk["metrics"])}
+
+    def _read_chunk(
+        self, chunk: Dict[str, Any], metrics: Dict[str, Dict[str, Any]]
+    ) -> "ColumnBatch":
+        columns = {
+            name: (
+                numpy.asarray(TextColumn([self._load_text(chunk, name, False)]))
+                if name in TEXT_COLUMNS
+                else self._load_array(self._chunk_dir(chunk) / f"{name}.npy")
+            )
+            for name in KEY_COLUMNS
+        }
+        values = self._load_values(chunk, False)
+        return ColumnBatch(columns, values, {name: metrics[name] for name in values})
+
+    def _write_chunk(
+        self, meta: Dict[str, Any], batch: "ColumnBatch"
+    ) -> Dict[str, Any]:
+        """
+        Write ``batch`` as a new chunk, it is not part of the store until it
+        is listed in the meta file
+        """
+        chunk: Dict[str, Any] = {
+            "name": str(meta["next_chunk"]),
+            "num_rows": len(batch),
+            "metrics": list(batch.values),
+        }
+        meta["next_chunk"] += 1
+        chunk_dir = self._chunk_dir(chunk)
+        chunk_dir.mkdir(parents=True, exist_ok=True)
+
+        for name in KEY_COLUMNS:
+            if name in TEXT_COLUMNS:
+                encoded = [s.encode("utf8") for s in batch.columns[name]]
+                offsets = numpy.cumsum(
+                    [0] + [len(e) for e in encoded], dtype=numpy.int64
+                )
+                atomic_write(chunk_dir / f"{name}.bin", b"".join(encoded))
+                self._save_array(chunk_dir / f"{name}.offsets.npy", offsets)
+            else:
+                self._save_array(chunk_dir / f"{name}.npy", batch.columns[name])
+
+        # column-major, so a memory mapped metric is one contiguous range
+        values = numpy.empty((len(batch), len(chunk["metrics"])), float, order="F")
+        for j, name in enumerate(chunk["metrics"]):
+            values[:, j] = batch.values[name]
+        self._save_array(chunk_dir / "values.npy", values)
+        return chunk
+
+    @property
+    def _manifest_file(self) -> Path:
+        return self.base_dir / "manifest.json"
+
+    def sources(self) -> Dict[str, List[Any]]:
+        """
+        Manifest of the run sources covered by the store: source name to the
+        source's stamp followed by the commit hash, e.g.
+        ``[mtime_ns, size, commit]``.
+        """
+        if not self.exists():
+            return {}
+        return self._read_json(self._manifest_file) or {}
+
+    def update(
+        self,
+        runs: Iterable[Run],
+        remove: Iterable[str] = (),
+        sources: Optional[Dict[str, List[Any]]] = None,
+    ) -> None:
+        """
+        Add ``runs`` to the store and drop the rows of the commits in
+        ``remove``. Rows of commits that are already present are replaced.
+        If given, ``sources`` replaces the manifest.
+        """
+        self.update_batches([ColumnBatch.from_runs(runs)], remove, sources)
+
+    def update_batches(
+        self,
+        batches: List["ColumnBatch"],
+        remove: Iterable[str] = (),
+        sources: Optional[Dict[str, List[Any]]] = None,
+    ) -> None:
+        """
+        Same as :meth:`update`, for runs that were already converted to
+        columns. The new rows are appended as a chunk, only chunks that hold
+        replaced or removed commits are rewritten.
+        """
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        meta = self._read_meta()
+        metrics = {m["name"]: m for m in meta["metrics"]}
+        new = ColumnBatch.concat(batches).deduplicate()
+        metrics.update(new.metrics)
+
+        drop = numpy.concatenate(
+            [numpy.array(list(remove), dtype=str), new.columns["commit"]]
+        )
+        chunks = []
+        for chunk in meta["chunks"]:
+            if len(drop) > 0:
+                commits = self._load_array(self._chunk_dir(chunk) / "commit.npy", True)
+                keep = ~numpy.isin(commits, drop)
+                if not keep.all():
+                    if not keep.any():
+                        continue
+                    rest = self._read_chunk(chunk, metrics).take(keep)
+                    chunk = self._write_chunk(meta, rest)
+            chunks.append(chunk)
+        if len(new) > 0:
+            chunks.append(self._write_chunk(meta, new))
+
+        while len(chunks) > 1 and (
+            chunks[-2]["num_rows"] <= chunks[-1]["num_rows"] or len(chunks) > MAX_CHUNKS
+        ):
+            merged = ColumnBatch.concat(
+                [self._read_chunk(c, metrics) for c in chunks[-2:]]
+            )
+            chunks[-2:] = [self._write_chunk(meta, merged)]
+
+        meta.update(
+            num_rows=sum(c["num_rows"] for c in chunks),
+            metrics=list(metrics.values()),
+            chunks=chunks,
+        )
+        atomic_write(self._meta_file, json.dumps(meta, indent=2))
+
+        if sources is not None:
+            # written last: if we fail before, the sources are just parsed again
+            atomic_write(self._manifest_file, json.dumps(sources))
+        self._remove_unused(chunks)
+
+    def _remove_unused(self, chunks: List[Dict[str, Any]]) -> None:
+        """
+        Delete chunks that were merged or rewritten, and the files of the
+        layout from before chunks
+        """
+        used = {c["name"] for c in chunks}
+        if self._chunks_dir.exists():
+            for path in self._chunks_dir.iterdir():
+                if path.name not in used:
+                    shutil.rmtree(path)
+        for path in self.base_dir.glob("*.npy"):
+            path.unlink()
+        shutil.rmtree(self.base_dir / "metrics", ignore_errors=True)
+
+    @staticmethod
+    def _save_array(path: Path, arr: numpy.ndarray) -> None:
+        buf = io.BytesIO()
+        numpy.save(buf, arr, allow_pickle=False)
+        atomic_write(path, buf.getvalue())
+
+
+def _concat(arrays: List[numpy.ndarray], dtype: Any) -> numpy.ndarray:
+    # a single chunk stays memory mapped
+    if len(arrays) == 1:
+        return arrays[0]
+    return numpy.concatenate([numpy.array([], dtype=dtype)] + arrays)
+
+
+def _iterate_rows(
+    opened: List[Tuple[int, Dict[str, Any], Dict[str, numpy.ndarray]]],
+    metrics: List[str],
+    chunk_size: int,
+) -> Iterator[Dict[str, numpy.ndarray]]:
+    for num_rows, keys, values in opened:
+        for start in range(0, num_rows, chunk_size):
+            rows = slice(start, min(start + chunk_size, num_rows))
+            out = {name: numpy.asarray(column[rows]) for name, column in keys.items()}
+            for name in metrics:
+                out[name] = (
+                    numpy.asarray(values[name][rows])
+                    if name in values
+                    else numpy.full(rows.stop - rows.start, numpy.nan)
+                )
+            yield out
+
+
+class ColumnBatch:
+    """
+    Key columns and metric values of a number of runs. The store is
+    extended batch by batch, and batches can be built in worker processes.
+    """
+
+    columns: Dict[str, numpy.ndarray]
+    values: Dict[str, numpy.ndarray]
+    metrics: Dict[str, Dict[str, Any]]
+
+    def __init__(
+        self,
+        columns: Dict[str, numpy.ndarray],
+        values: Dict[str, numpy.ndarray],
+        metrics: Dict[str, Dict[str, Any]],
+    ) -> None:
+        self.columns = columns
+        self.values = values
+        self.metrics = metrics
+
+    def __len__(self) -> int:
+        return len(self.columns["commit"])
+
+    @classmethod
+    def from_runs(cls, runs: Iterable[Run]) -> "ColumnBatch":
+        rows: Dict[str, List[Any]] = {k: [] for k in KEY_COLUMNS}
+        values: Dict[str, List[float]] = {}
+        metrics: Dict[str, Dict[str, Any]] = {}
+
+        # the last run for a commit wins
+        by_commit = {run.commit.hash: run for run in runs}
+        for i, run in enumerate(by_commit.values()):
+            rows["commit"].append(run.commit.hash)
+            rows["parent"].append(run.parent.hash if run.parent is not None else "")
+            rows["branch"].append(run.branch)
+            rows["date"].append(run.commit.date.isoformat())
+            rows["message"].append(run.commit.message)
+
+            for m in run.results:
+                column = values.setdefault(m.name, [numpy.nan] * i)
+                column.append(numpy.nan if m.value is None else m.value)
+                metrics[m.name] = {"name": m.name, "group": m.group, "unit": m.unit}
+            for column in values.values():
+                if len(column) < i + 1:
+                    column.append(numpy.nan)
+
+        return cls(
+            {
+                k: numpy.array(v, dtype=object if k in TEXT_COLUMNS else str)
+                for k, v in rows.items()
+            },
+            {k: numpy.array(v, dtype=float) for k, v in values.items()},
+            metrics,
+        )
+
+    def take(self, rows: numpy.ndarray) -> "ColumnBatch":
+        return ColumnBatch(
+            {k: v[rows] for k, v in self.columns.items()},
+            {k: v[rows] for k, v in self.values.items()},
+            self.metrics,
+        )
+
+    @classmethod
+    def concat(cls, batches: List["ColumnBatch"]) -> "ColumnBatch":
+        metrics: Dict[str, Dict[str, Any]] = {}
+        for batch in batches:
+            metrics.update(batch.metrics)
+
+        columns = {
+            k: numpy.concatenate(
+                [numpy.array([], dtype=str)] + [b.columns[k] for b in batches]
+            )
+            for k in KEY_COLUMNS
+        }
+        values = {
+            name: numpy.concatenate(
+                [numpy.array([], dtype=float)]
+                + [b.values.get(name, numpy.full(len(b), numpy.nan)) for b in batches]
+            )
+            for name in metrics
+        }
+        return cls(columns, values, metrics)
+
+    def deduplicate(self) -> "ColumnBatch":
+        """
+        Keep only the last row of every commit
+        """
+        commits = self.columns["commit"]
+        _, idx = numpy.unique(commits[::-1], return_index=True)
+        return self.take(numpy.sort(len(commits) - 1 - idx))
@@ -0,0 +1,44 @@
+import bz2
+import gzip
+import lzma
+from typing import Callable, Dict, Tuple
+
+from headwind.spec import Compression
+
+# compress function, file suffix and magic bytes of each codec
+_codecs: Dict[Compression, Tuple[Callable[[bytes], bytes], str, bytes]] = {
+    Compression.Gzip: (lambda d: gzip.compress(d, mtime=0), ".gz", b"\x1f\x8b"),
+    Compression.Bz2: (bz2.compress, ".bz2", b"BZh"),
+    Compression.Lzma: (lzma.compress, ".xz", b"\xfd7zXZ\x00"),
+}
+
+_decompress: Dict[bytes, Callable[[bytes], bytes]] = {
+    b"\x1f\x8b": gzip.decompress,
+    b"BZh": bz2.decompress,
+    b"\xfd7zXZ\x00": lzma.decompress,
+}
+
+SUFFIXES = tuple(suffix for _, suffix, _ in _codecs.values())
+
+
+def suffix(compression: Compression) -> str:
+    if compression == Compression.Off:
+        return ""
+    return _codecs[compression][1]
+
+
+def compress(data: bytes, compression: Compression) -> bytes:
+    if compression == Compression.Off:
+        return data
+    return _codecs[compression][0](data)
+
+
+def decompress(data: bytes) -> bytes:
+    """
+    Decompress ``data`` with the codec identified by its magic bytes.
+    Uncompressed data is returned as is.
+    """
+    for magic, fn in _decompress.items():
+        if data.startswith(magic):
+            return fn(data)
+    return data
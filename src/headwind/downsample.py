@@ -0,0 +1,41 @@
+from typing import cast
+
+import numpy
+
+
+def _first_per_bucket(order: numpy.ndarray, bucket: numpy.ndarray) -> numpy.ndarray:
+    # ``order`` sorts by bucket first, the first entry of every run of equal
+    # buckets is that bucket's extreme
+    sorted_buckets = bucket[order]
+    first = numpy.ones(len(order), dtype=bool)
+    first[1:] = sorted_buckets[1:] != sorted_buckets[:-1]
+    return cast(numpy.ndarray, order[first])
+
+
+def min_max_indices(values: numpy.ndarray, max_points: int) -> numpy.ndarray:
+    """
+    Indices of at most ``max_points`` of ``values`` that keep the shape of
+    the series: the series is split into equally sized buckets, and the
+    minimum and maximum of every bucket are kept, along with the first and
+    last point. Unlike averaging, this keeps single spikes visible. Missing
+    values are only kept if a bucket has nothing else.
+    """
+    n = len(values)
+    assert max_points >= 4, "Need room for at least one bucket"
+    if n <= max_points:
+        return numpy.arange(n)
+
+    num_buckets = (max_points - 2) // 2
+    bucket = numpy.arange(n) * num_buckets // n
+    missing = numpy.isnan(values)
+
+    lowest = _first_per_bucket(
+        numpy.lexsort((numpy.where(missing, numpy.inf, values), bucket)), bucket
+    )
+    highest = _first_per_bucket(
+        numpy.lexsort((numpy.where(missing, numpy.inf, -values), bucket)), bucket
+    )
+
+    return cast(
+        numpy.ndarray, numpy.unique(numpy.concatenate([[0, n - 1], lowest, highest]))
+    )
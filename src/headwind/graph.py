@@ -0,0 +1,97 @@
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+import numpy
+import pandas
+
+
+class CommitGraph:
+    """
+    In-memory index of the run history: commit hash to parent hash, branch
+    and date. Allows walking branch histories without loading any runs.
+    """
+
+    commit: numpy.ndarray
+    parent: numpy.ndarray
+    branch: numpy.ndarray
+    date: numpy.ndarray
+
+    _index: Dict[str, int]
+
+    def __init__(
+        self,
+        commit: numpy.ndarray,
+        parent: numpy.ndarray,
+        branch: numpy.ndarray,
+        date: numpy.ndarray,
+    ) -> None:
+        self.commit = commit
+        self.parent = parent
+        self.branch = branch
+        self.date = date
+        self._index = {h: i for i, h in enumerate(commit)}
+
+    @classmethod
+    def from_columns(cls, data: Dict[str, numpy.ndarray]) -> "CommitGraph":
+        return cls(data["commit"], data["parent"], data["branch"], data["date"])
+
+    def __contains__(self, commit: str) -> bool:
+        return commit in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def walk(self, start: str, limit: Optional[int] = None) -> Iterator[int]:
+        """
+        Yield the row indices of ``start`` and its ancestors, newest first.
+        Stops after ``limit`` rows, or when a parent is not part of the graph.
+        """
+        seen: Set[int] = set()
+        current = self._index.get(start)
+        while current is not None:
+            if limit is not None and len(seen) >= limit:
+                return
+            if current in seen:
+                raise RuntimeError(
+                    f"Cycle in commit sequence detected: {self.commit[current]}"
+                )
+            seen.add(current)
+            yield current
+            current = self._index.get(self.parent[current])
+
+    def history(self, start: str, limit: Optional[int] = None) -> Iterator[str]:
+        for i in self.walk(start, limit):
+            yield str(self.commit[i])
+
+    def select(
+        self,
+        tips: Iterable[str],
+        since: Optional[datetime] = None,
+        limit: Optional[int] = None,
+    ) -> numpy.ndarray:
+        """
+        Row indices of the histories of ``tips``, newest first per tip. Only
+        rows dated ``since`` or later are kept, at most ``limit`` per tip.
+        Naive dates are taken to be UTC.
+        """
+        if since is None:
+            return numpy.array(
+                [row for tip in tips for row in self.walk(tip, limit)], dtype=int
+            )
+
+        since_ts = pandas.Timestamp(since)
+        if since_ts.tzinfo is None:
+            since_ts = since_ts.tz_localize("UTC")
+        dates = pandas.to_datetime(self.date, utc=True, format="ISO8601")
+        recent = numpy.asarray(dates >= since_ts)
+
+        rows: List[int] = []
+        for tip in tips:
+            n = 0
+            for row in self.walk(tip):
+                if limit is not None and n >= limit:
+                    break
+                if recent[row]:
+                    rows.append(row)
+                    n += 1
+        return numpy.array(rows, dtype=int)
@@ -0,0 +1,151 @@
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Dict, Optional, Type, Union
+
+if sys.platform == "win32":  # pragma: no cover
+    import msvcrt
+
+    def _try_lock(fd: int) -> bool:
+        # a lock on the first byte, files can be locked past their end
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def _unlock(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _try_lock(fd: int) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _unlock(fd: int) -> None:
+        # closing the file drops the lock
+        pass
+
+
+class LockTimeout(RuntimeError):
+    pass
+
+
+class FileLock:
+    """
+    Inter-process lock based on ``flock`` on a lock file, ``msvcrt.locking``
+    on Windows. Acquiring retries with exponential backoff until ``timeout``
+    seconds have passed. The lock file is never removed, and the kernel
+    releases the lock when the holding process exits, so locks of crashed
+    processes need no clean up. The lock is reentrant within a thread, other
+    threads of the process wait for it up to ``timeout`` as well.
+    """
+
+    path: Path
+    timeout: float
+
+    def __init__(
+        self,
+        path: Path,
+        timeout: float = 120,
+        min_delay: float = 0.005,
+        max_delay: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._depth = 0
+        self._fd: Optional[int] = None
+        self._local = threading.RLock()
+
+    def _try_acquire(self) -> bool:
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+        if not _try_lock(fd):
+            os.close(fd)
+            return False
+        # for humans looking at a hanging lock
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def acquire(self) -> None:
+        deadline = time.monotonic() + self.timeout
+        if not self._local.acquire(timeout=self.timeout):
+            raise LockTimeout(f"Unable to acquire lock {self.path}")
+        if self._depth > 0:
+            self._depth += 1
+            return
+
+        delay = self.min_delay
+        while not self._try_acquire():
+            if time.monotonic() > deadline:
+                self._local.release()
+                raise LockTimeout(f"Unable to acquire lock {self.path}")
+            # jitter, so waiting writers do not retry in lockstep
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, self.max_delay)
+        self._depth = 1
+
+    def release(self) -> None:
+        assert self._depth > 0, "Lock is not held"
+        self._depth -= 1
+        if self._depth == 0:
+            assert self._fd is not None
+            _unlock(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._local.release()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the in-process state does not travel to other processes
+        state = self.__dict__.copy()
+        del state["_local"]
+        state["_depth"] = 0
+        state["_fd"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._local = threading.RLock()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.release()
+
+
+def atomic_write(path: Path, data: Union[str, bytes]) -> None:
+    """
+    Write ``data`` to a temporary file next to ``path`` and rename it into
+    place, so readers never see a partially written file. This does not
+    fsync, it protects against concurrent readers, not against power loss.
+    """
+    mode = "wb" if isinstance(data, bytes) else "w"
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, mode) as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
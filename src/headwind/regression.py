@@ -0,0 +1,140 @@
+from enum import Enum
+from typing import List, Optional
+
+import numpy
+import pandas
+from pydantic import BaseModel
+
+from headwind.spec import Metric
+
+
+class ChangeKind(str, Enum):
+    Regression = "regression"
+    Improvement = "improvement"
+
+
+class Change(BaseModel):
+    kind: ChangeKind
+    metric: str
+    group: Optional[str]
+    unit: str
+    branch: str
+    # first commit after the change, and the one before it
+    commit: str
+    parent: str
+    message: str
+    before: float
+    after: float
+    # relative change of the mean, (after - before) / |before|
+    change: float
+    score: float
+
+    def to_metric(self) -> Metric:
+        return Metric(name=self.metric, group=self.group, unit=self.unit, value=None)
+
+
+def _rolling_mean(
+    values: pandas.DataFrame, window: int, forward: bool
+) -> pandas.DataFrame:
+    """
+    Mean over the ``window`` rows before each row, or, with ``forward``, over
+    the row itself and the ``window - 1`` rows after it
+    """
+    if forward:
+        return values[::-1].rolling(window, min_periods=window).mean()[::-1]
+    return values.rolling(window, min_periods=window).mean().shift(1)
+
+
+def _noise(values: pandas.DataFrame, resolution: float) -> numpy.ndarray:
+    # the spread of the differences between neighbouring runs, which level
+    # shifts barely affect, as a standard deviation per column
+    mad = values.diff().abs().median().to_numpy()
+    sigma = mad / (0.6745 * numpy.sqrt(2))
+    floor = resolution * numpy.abs(values.median().to_numpy())
+    return numpy.asarray(numpy.sqrt(sigma**2 + floor**2))
+
+
+def detect_changes(
+    df: pandas.DataFrame,
+    metrics: List[Metric],
+    window: int = 10,
+    threshold: float = 5.0,
+    min_change: float = 0.05,
+    resolution: float = 1e-3,
+) -> List[Change]:
+    """
+    Find the commits at which the level of a metric shifted, per branch of
+    the wide frame ``df`` (rows newest first within each branch, as returned
+    by :meth:`Storage.dataframe`). For every commit, the mean of the
+    ``window`` runs before it is compared to the mean of it and the runs
+    after it, in standard errors of the difference. The noise of a series is
+    estimated from the differences between neighbouring runs, and taken to
+    be at least ``resolution`` times its median, so steps in constant series
+    score high but finite. Shifts with a score of at least ``threshold`` and
+    a relative change of at least ``min_change`` are reported, one per peak
+    of the score. All metrics of a branch are processed at once. Higher
+    values are taken to be worse.
+    Returns the changes ordered by the size of the relative change.
+    """
+    names = [m.name for m in metrics]
+    by_name = {m.name: m for m in metrics}
+    changes: List[Change] = []
+
+    for branch, branch_df in df.groupby("branch", sort=False):
+        # oldest first
+        branch_df = branch_df.iloc[::-1].reset_index(drop=True)
+        if len(branch_df) < 2 * window:
+            continue
+        values = branch_df[names].astype(float)
+
+        before = _rolling_mean(values, window, forward=False)
+        after = _rolling_mean(values, window, forward=True)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            diff = (after - before).to_numpy()
+            # standard deviations of the difference of the two means
+            score = numpy.abs(diff) / (
+                _noise(values, resolution) * numpy.sqrt(2 / window)
+            )
+            rel = diff / numpy.abs(before.to_numpy())
+
+        score = numpy.where(numpy.isnan(score), 0.0, score)
+        # only the peak of the score around a shift is reported
+        peak = (
+            pandas.DataFrame(score)
+            .rolling(2 * window + 1, center=True, min_periods=1)
+            .max()
+            .to_numpy()
+        )
+        found = (
+            (score >= threshold)
+            & (score == peak)
+            & numpy.isfinite(rel)
+            & (numpy.abs(rel) >= min_change)
+        )
+
+        for row, col in zip(*numpy.nonzero(found)):
+            metric = by_name[names[col]]
+            changes.append(
+                Change(
+                    kind=(
+                        ChangeKind.Regression
+                        if diff[row, col] > 0
+                        else ChangeKind.Improvement
+                    ),
+                    metric=metric.name,
+                    group=metric.group,
+                    unit=metric.unit,
+                    branch=branch,
+                    commit=branch_df.commit[row],
+                    parent=branch_df.commit[row - 1],
+                    message=branch_df.message[row],
+                    before=before.iat[row, col],
+                    after=after.iat[row, col],
+                    change=rel[row, col],
+                    score=score[row, col],
+                )
+            )
+
+    changes.sort(key=lambda c: abs(c.change), reverse=True)
+    return changes
@@ -1,39 +1,74 @@
 from datetime import datetime
+import hashlib
+import json
 from pathlib import Path
-import shutil
-from typing import Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import contextlib
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextvars
+import functools
+import math
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from enum import Enum
 import re
 
 import jinja2
+import numpy
 from wasabi import msg
 import rich.progress
 import pandas
 
+from headwind.downsample import min_max_indices
+from headwind.locking import atomic_write
+from headwind.regression import detect_changes
 from headwind.spec import Metric, Spec
 from headwind.storage import Storage
+from headwind.timing import submit_timed, timed, timed_result
 
-current_depth = 0
-current_url = "/"
+try:
+    import orjson
+
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode("utf8")
+
+except ImportError:  # pragma: no cover
+
+    def _json_dumps(obj: Any) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+
+# the page being rendered, context variables so concurrent renders in
+# threads do not see each other's pages
+current_depth: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "current_depth", default=0
+)
+current_url: contextvars.ContextVar[Union[str, Path]] = contextvars.ContextVar(
+    "current_url", default="/"
+)
 
 
 @contextlib.contextmanager
 def push_depth(n: int = 1):
-    global current_depth
-    current_depth += n
-    yield
-    current_depth -= n
+    token = current_depth.set(current_depth.get() + n)
+    try:
+        yield
+    finally:
+        current_depth.reset(token)
 
 
 @contextlib.contextmanager
 def push_url(url: Path):
-    global current_url
-    prev = current_url
-    current_url = url
-    with push_depth(len(current_url.parts)):
-        yield
-    current_url = prev
+    token = current_url.set(url)
+    try:
+        with push_depth(len(url.parts)):
+            yield
+    finally:
+        current_url.reset(token)
 
 
 def prefix_url(prefix: str):
@@ -59,7 +94,7 @@ def url_for(url: Union[str, Path]) -> Path:
     assert isinstance(url, Path)
 
     prefix = Path(".")
-    for _ in range(current_depth):
+    for _ in range(current_depth.get()):
         prefix = prefix / ".."
 
     # print(prefix / url)
@@ -71,14 +106,41 @@ def path_sanitize(path: str) -> str:
     return path.replace("/", "_")
 
 
+def chart_name(branch: str) -> str:
+    """
+    File name stem of the chart data of ``branch``. Hashed, so distinct
+    branch names never share a file and any name is safe in a URL.
+    """
+    return "chart_" + hashlib.sha1(branch.encode("utf8")).hexdigest()[:16]
+
+
 # static_url = prefix_url("static")
 
 
+# the static files the templates use, published under content hashed names
+STATIC_ASSETS = ["chart.min.js", "css/bulma/bulma.min.css"]
+
+
+@functools.lru_cache(maxsize=None)
+def static_assets() -> Dict[str, str]:
+    """
+    The published name of every static asset, by its name in the package.
+    The content hash goes before the suffix, ``chart.min.js`` becomes
+    ``chart.min.<hash>.js``, so the files can be cached forever.
+    """
+    static = Path(__file__).parent / "static"
+    assets = {}
+    for name in STATIC_ASSETS:
+        path = Path(name)
+        digest = hashlib.sha256((static / path).read_bytes()).hexdigest()[:12]
+        assets[name] = path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+    return assets
+
+
 def static_url(url: Union[str, Path]) -> Path:
-    if isinstance(url, str):
-        url = Path(url)
-    assert isinstance(url, Path)
-    return url_for("static" / url)
+    if isinstance(url, Path):
+        url = url.as_posix()
+    return url_for("static" / Path(static_assets()[url]))
 
 
 def metric_url(metric: Metric) -> Path:
@@ -94,12 +156,11 @@ def group_url(group: str) -> Path:
 
 
 def is_group_active(group: str) -> bool:
-    return str(url_for(current_url)).startswith(str(group_url(group)))
+    return str(url_for(current_url.get())).startswith(str(group_url(group)))
 
 
 def get_current_url():
-    global current_url
-    return current_url
+    return current_url.get()
 
 
 def smart_truncate(s, n):
@@ -116,13 +177,24 @@ def smart_truncate(s, n):
     return "{0}...{1}".format(s[:n_1], s[-n_2:])
 
 
-github_project: str = None
+github_project: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "github_project", default=None
+)
+# environment with the report navigation, built once per worker process
+report_env: contextvars.ContextVar[jinja2.Environment] = contextvars.ContextVar(
+    "report_env"
+)
+
+
+class RenderMode(str, Enum):
+    Processes = "processes"
+    Threads = "threads"
 
 
 def issue_links(s):
     def rep(m):
         num = m.group(1)
-        return f'<a target="blank" href="https://github.com/{github_project}/issues/{num}">#{num}</a>'
+        return f'<a target="blank" href="https://github.com/{github_project.get()}/issues/{num}">#{num}</a>'
 
     r, _ = re.subn(r"#(\d+)", rep, s)
     return r
@@ -132,11 +204,141 @@ def first_line(s):
     return s.split("\n")[0]
 
 
+def percent(v: float) -> str:
+    return "" if numpy.isnan(v) else f"{v:+.1%}"
+
+
 def dateformat(d, fmt):
     assert isinstance(d, datetime)
     return d.strftime(fmt)
 
 
+def format_dates(dates: pandas.Series, fmt: str) -> pandas.Series:
+    if pandas.api.types.is_datetime64_any_dtype(dates):
+        return dates.dt.strftime(fmt)
+    # mixed UTC offsets are kept as datetime objects
+    return dates.map(lambda d: d.strftime(fmt))
+
+
+def chart_json(
+    tpl_df: pandas.DataFrame,
+    num_commits: Optional[int],
+    max_points: Optional[int] = None,
+) -> str:
+    """
+    The chart points of the newest ``num_commits`` rows, all if ``None``, as
+    JSON. With ``max_points``, longer series are downsampled to that many
+    points.
+    """
+    head = tpl_df.iloc[:num_commits]
+    if max_points is not None:
+        head = head.iloc[min_max_indices(head.value.to_numpy(dtype=float), max_points)]
+    labels = head.commit.str[:7] + " " + format_dates(head.date, "%Y-%m-%d")
+    # floats keep all their digits, missing values become null
+    values = [
+        v if math.isfinite(v) else None
+        for v in head.value.to_numpy(dtype=float).tolist()
+    ]
+    return _json_dumps(
+        [
+            {"x": x, "y": y, "commit": commit, "message": message}
+            for x, y, commit, message in zip(
+                labels.tolist(), values, head.commit.tolist(), head.message.tolist()
+            )
+        ]
+    )
+
+
+def table_frame(tpl_df: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    ``tpl_df`` with the date, message and value columns formatted for display
+    """
+    link = (
+        f'<a target="blank" href="https://github.com/{github_project.get()}'
+        r'/issues/\1">#\1</a>'
+    )
+    return tpl_df.assign(
+        date=format_dates(tpl_df.date, "%Y-%m-%d %H:%M"),
+        message=tpl_df.message.str.partition("\n")[0].str.replace(
+            r"#(\d+)", link, regex=True
+        ),
+        value=numpy.char.mod("%.2f", tpl_df.value.to_numpy(dtype=float)),
+    )
+
+
+def relative_change(new: numpy.ndarray, old: numpy.ndarray) -> numpy.ndarray:
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        change = (new - old) / numpy.abs(old)
+    return numpy.where(numpy.isfinite(change), change, numpy.nan)
+
+
+def group_summary(
+    df: pandas.DataFrame,
+    metrics: List[Metric],
+    num_points: int,
+    compare: int,
+) -> pandas.DataFrame:
+    """
+    One row per branch and metric, with the newest value, its relative change
+    to the parent and to ``compare`` commits before, and the SVG polyline of
+    the newest ``num_points`` values, scaled to a 100 x 20 box. Every branch
+    is computed for all ``metrics`` at once.
+    """
+    names = [m.name for m in metrics]
+    empty = pandas.DataFrame(
+        columns=[
+            "branch",
+            "metric",
+            "unit",
+            "value",
+            "vs_parent",
+            "vs_compare",
+            "sparkline",
+        ]
+    )
+    if not names:
+        # every metric of the group was filtered out
+        return empty
+    frames = []
+    for branch, branch_df in df.groupby("branch", sort=False):
+        # rows are newest first
+        values = branch_df[names].to_numpy(dtype=float)
+        n = len(values)
+
+        def row(i: int) -> numpy.ndarray:
+            return values[i] if i < n else numpy.full(len(names), numpy.nan)
+
+        # oldest first, scaled per metric
+        spark = pandas.DataFrame(values[:num_points][::-1])
+        low = spark.min().to_numpy()
+        span = (spark.max().to_numpy() - low).astype(float)
+        span[span == 0] = numpy.nan
+        y = numpy.nan_to_num(20 - (spark.to_numpy() - low) / span * 20, nan=10.0)
+        x = numpy.linspace(0, 100, len(spark))[:, numpy.newaxis]
+        coords = numpy.char.add(
+            numpy.char.mod("%.1f,", numpy.broadcast_to(x, y.shape)),
+            numpy.char.mod("%.1f", y),
+        )
+        present = spark.notna().to_numpy()
+
+        frames.append(
+            pandas.DataFrame(
+                {
+                    "branch": branch,
+                    "metric": names,
+                    "unit": [m.unit for m in metrics],
+                    "value": row(0),
+                    "vs_parent": relative_change(row(0), row(1)),
+                    "vs_compare": relative_change(row(0), row(compare)),
+                    "sparkline": [
+                        " ".join(coords[present[:, j], j]) for j in range(len(names))
+                    ],
+                }
+            )
+        )
+    return pandas.concat(frames, ignore_index=True) if frames else empty
+
+
 def make_environment() -> jinja2.Environment:
     env = jinja2.Environment(loader=jinja2.PackageLoader(package_name="headwind"))
 
@@ -152,137 +354,408 @@ def make_environment() -> jinja2.Environment:
     env.filters["issue_links"] = issue_links
     env.filters["first_line"] = first_line
     env.filters["dateformat"] = dateformat
+    env.filters["percent"] = percent
 
     return env
 
 
-def copy_static(output: Path) -> None:
+def copy_static(output: Path) -> int:
+    """
+    Publish the static assets to ``output / "static"``. The names change with
+    the content, so only missing files are copied. Files from earlier
+    publishes that are no longer used are removed. Returns the number of
+    files copied.
+    """
     static = Path(__file__).parent / "static"
-    assert static.exists()
     dest = output / "static"
+    published = static_assets()
+
+    copied = 0
+    for name, target in published.items():
+        file = dest / target
+        if file.exists():
+            continue
+        file.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(file, (static / name).read_bytes())
+        copied += 1
+
     if dest.exists():
-        shutil.rmtree(dest)
-    shutil.copytree(static, dest)
+        keep = set(published.values())
+        for file in sorted(dest.rglob("*"), reverse=True):
+            if file.is_dir():
+                if not any(file.iterdir()):
+                    file.rmdir()
+            elif file.relative_to(dest).as_posix() not in keep:
+                file.unlink()
+    return copied
+
+
+# content hashes of the inputs of every rendered page, by page path
+MANIFEST_FILE = ".headwind-manifest.json"
+# suspected regressions and improvements, for other tools
+CHANGES_FILE = "changes.json"
+
+
+def read_manifest(output: Path) -> Dict[str, str]:
+    file = output / MANIFEST_FILE
+    if not file.exists():
+        return {}
+    with file.open("r") as fh:
+        return json.load(fh)  # type: ignore
+
+
+def content_hash(*parts: Union[str, bytes]) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        data = part.encode("utf8") if isinstance(part, str) else part
+        # length prefix, so the parts cannot run into each other
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+def templates_hash() -> str:
+    templates = Path(__file__).parent / "templates"
+    return content_hash(
+        *(f.read_bytes() for f in sorted(templates.iterdir()) if f.is_file())
+    )
+
+
+def metric_frame(df: pandas.DataFrame, metric: Metric) -> pandas.DataFrame:
+    tpl_df_cols = ["branch", "commit", "date", "message", metric.name]
+    # indexing with a list already makes a new frame
+    return df[tpl_df_cols].rename(columns={metric.name: "value"})
+
+
+def metric_page(metric: Metric) -> str:
+    return (metric_url(metric) / "index.html").as_posix()
+
+
+def remove_pages(output: Path, pages: List[str]) -> None:
+    for page in pages:
+        file = output / page
+        file.unlink(missing_ok=True)
+        for chart in file.parent.glob("chart_*.json"):
+            chart.unlink()
+        # clean up directories that became empty
+        parent = file.parent
+        while parent != output and parent.exists() and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
+
+
+def init_worker(
+    metrics_by_group: Dict[str, List[Metric]], project: Optional[str]
+) -> None:
+    # shared by all pages, so it is sent and built once per worker
+    github_project.set(project)
+    env = make_environment()
+    env.globals["metrics"] = metrics_by_group
+    env.globals["github_project"] = project
+    report_env.set(env)
 
 
 def process_metric(
     metric: Metric,
-    df: pandas.DataFrame,
+    tpl_df: pandas.DataFrame,
     output: Path,
-    metrics_by_group,
-    github_project: str,
-    num_commits: int,
+    chart_df: Optional[pandas.DataFrame] = None,
+    max_points: Optional[int] = None,
 ):
     url = metric_url(metric)
     # print(url)
     page = output / url / "index.html"
 
-    env = make_environment()
-    env.globals["metrics"] = metrics_by_group
-    env.globals["github_project"] = github_project
-
-    metric_tpl = env.get_template("metric.html.j2")
+    metric_tpl = report_env.get().get_template("metric.html.j2")
 
-    if not page.parent.exists():
-        page.parent.mkdir(parents=True)
+    # group and metric pages share parent directories, and render at once
+    page.parent.mkdir(parents=True, exist_ok=True)
 
     metric_plots = []
 
-    tpl_df_cols = ["branch", "commit", "date", "message", metric.name]
-    tpl_df = df[tpl_df_cols].copy()
-    # tpl_df.commit = tpl_df.commit.str[:7]
-    tpl_df.columns = ["branch", "commit", "date", "message", "value"]
-
-    chart_data = []
-    for row in tpl_df.itertuples():
-        chart_data.append(
-            {
-                "x": f"{row.commit[:7]} {row.date.strftime('%Y-%m-%d')}",
-                "y": row.value,
-                "commit": row.commit,
-                "message": row.message,
-            }
+    # one file per branch, fetched by the page once the chart is visible, the
+    # charts show the table's commits unless they have their own
+    if chart_df is None:
+        chart_df = tpl_df
+    charts: Dict[str, Dict[str, Optional[str]]] = {}
+    for branch, branch_df in chart_df.groupby("branch"):
+        name = chart_name(branch)
+        src = f"{name}.json"
+        chart: Dict[str, Optional[str]] = {"src": src, "full": None}
+        with timed("chart json", "step"):
+            (page.parent / src).write_text(chart_json(branch_df, None, max_points))
+            if max_points is not None and len(branch_df) > max_points:
+                # full resolution, only fetched on request
+                full = f"{name}.full.json"
+                chart["full"] = full
+                (page.parent / full).write_text(chart_json(branch_df, None))
+        charts[branch] = chart
+    written = {f for chart in charts.values() for f in chart.values()}
+    for f in page.parent.glob("chart_*.json"):
+        if f.name not in written:
+            f.unlink()
+
+    with timed("table", "step"):
+        dataframe = table_frame(tpl_df)
+
+    with push_url(url), timed("template", "step"):
+        html = metric_tpl.render(
+            metric=metric,
+            plots=metric_plots,
+            dataframe=dataframe,
+            charts=charts,
         )
+    with timed("write", "step"):
+        page.write_text(html)
 
-    chart_data = chart_data[:num_commits]
+    return metric
 
-    with push_url(url):
-        page.write_text(
-            metric_tpl.render(
-                metric=metric,
-                plots=metric_plots,
-                dataframe=tpl_df,
-                chart_data=chart_data,
-            )
+
+def process_group(
+    group: str, summary: pandas.DataFrame, compare: int, output: Path
+) -> str:
+    url = group_url(group)
+    page = output / url / "index.html"
+
+    group_tpl = report_env.get().get_template("group.html.j2")
+
+    page.parent.mkdir(parents=True, exist_ok=True)
+
+    by_name = {m.name: m for m in group_tpl.globals["metrics"][group]}
+
+    with push_url(url), timed("template", "step"):
+        html = group_tpl.render(
+            group=group, summary=summary, compare=compare, by_name=by_name
         )
+    with timed("write", "step"):
+        page.write_text(html)
 
-    return metric
+    return group
+
+
+def render_page(page: str, fn: Callable[..., Any], *args: Any) -> Any:
+    with timed(page, "page"):
+        return fn(*args)
 
 
-def make_report(spec: Spec, storage: Storage, output: Path) -> None:
+def make_report(
+    spec: Spec,
+    storage: Storage,
+    output: Path,
+    jobs: int = 1,
+    force: bool = False,
+    render_mode: RenderMode = RenderMode.Processes,
+) -> None:
     print(storage.get_branches())
     msg.info("Begin report generation")
-    global github_project
-    github_project = spec.github_project
-
-    with rich.progress.Progress() as progress:
-        task = progress.add_task("Creating dataframe", total=storage.num_runs())
 
-        def update():
-            progress.advance(task)
+    chart_commits = spec.report_chart_commits
+    if chart_commits is None:
+        chart_commits = spec.report_num_commits
+
+    # the stored runs are scanned once for all the reads below
+    with storage.synced():
+        with rich.progress.Progress() as progress:
+            task = progress.add_task("Creating dataframe", total=storage.num_runs())
+
+            def update():
+                progress.advance(task)
+
+            # tables, filters and group pages only look at the newest commits,
+            # only those are loaded
+            with timed("query"):
+                df = storage.query(
+                    limit_per_branch=spec.report_num_commits,
+                    progress_callback=update,
+                    jobs=jobs,
+                )
+        with timed("filter metrics"):
+            metrics_by_group = storage.get_metrics()
 
-        df, metrics_by_group = storage.dataframe(
-            with_metrics=True, progress_callback=update
-        )
+            metrics_by_group = {
+                g: list(filter(lambda m: spec.report_filter(m, df), ms))
+                for g, ms in metrics_by_group.items()
+            }
 
-    metrics_by_group = {
-        g: list(filter(lambda m: spec.report_filter(m, df), ms))
-        for g, ms in metrics_by_group.items()
-    }
+        # charts and change detection have a window of their own
+        if chart_commits > spec.report_num_commits:
+            with timed("query charts"):
+                history = storage.query(
+                    metrics=[m.name for ms in metrics_by_group.values() for m in ms],
+                    limit_per_branch=chart_commits,
+                )
+        elif chart_commits < spec.report_num_commits:
+            history = (
+                df.groupby("branch", sort=False)
+                .head(chart_commits)
+                .reset_index(drop=True)
+            )
+        else:
+            history = df
 
     msg.good("Dataframe created")
 
-    env = make_environment()
-    env.globals["metrics"] = metrics_by_group
-    env.globals["github_project"] = spec.github_project
+    init_worker(metrics_by_group, spec.github_project)
+
+    with timed("copy static"):
+        copy_static(output)
+
+    # pages are only rendered again if their inputs changed
+    old_manifest = read_manifest(output)
+    manifest: Dict[str, str] = {}
+
+    def is_current(page: str, key: str) -> bool:
+        manifest[page] = key
+        if force:
+            return False
+        return old_manifest.get(page) == key and (output / page).exists()
+
+    # everything that goes into every page: templates, assets and navigation
+    base_key = content_hash(
+        templates_hash(),
+        json.dumps(static_assets()),
+        json.dumps(
+            {g: [m.name for m in ms] for g, ms in metrics_by_group.items()},
+        ),
+        str(spec.github_project),
+    )
 
-    copy_static(output)
+    rendered = 0
 
-    global current_url
+    # on the chart history, shifts older than the tables are found as well
+    with timed("detect changes"):
+        changes = detect_changes(
+            history, [m for ms in metrics_by_group.values() for m in ms]
+        )
+    changes_json = json.dumps([c.dict() for c in changes], indent=2)
+    atomic_write(output / CHANGES_FILE, changes_json)
+    msg.info(f"Found {len(changes)} suspected change(s)")
 
     # start page
-    tpl = env.get_template("index.html.j2")
-    current_url = "/"
-    (output / "index.html").write_text(tpl.render())
-
-    group_tpl = env.get_template("group.html.j2")
-
-    for group, metrics in metrics_by_group.items():
-        msg.info(f"Group: {group}")
-
-        with ProcessPoolExecutor() as ex:
-            futures = [
-                ex.submit(
-                    process_metric,
-                    m,
+    index_key = content_hash(base_key, "index", changes_json, str(chart_commits))
+    if not is_current("index.html", index_key):
+        with timed("index.html", "page"):
+            tpl = report_env.get().get_template("index.html.j2")
+            (output / "index.html").write_text(
+                tpl.render(changes=changes, window=chart_commits)
+            )
+        rendered += 1
+
+    # (size, function, arguments) of every page that needs rendering
+    tasks: List[Tuple[int, Callable[..., Any], Tuple[Any, ...]]] = []
+
+    with timed("plan pages"):
+        for group, metrics in metrics_by_group.items():
+            for m in metrics:
+                # workers only get the commit columns and this metric's values
+                tpl_df = metric_frame(df, m)
+                chart_df = None if history is df else metric_frame(history, m)
+                key = content_hash(
+                    base_key,
+                    m.json(),
+                    str(spec.report_chart_points),
+                    *(
+                        pandas.util.hash_pandas_object(frame, index=False)
+                        .to_numpy()
+                        .tobytes()
+                        for frame in (tpl_df, chart_df)
+                        if frame is not None
+                    ),
+                )
+                if not is_current(metric_page(m), key):
+                    tasks.append(
+                        (
+                            len(tpl_df) + (0 if chart_df is None else len(chart_df)),
+                            render_page,
+                            (
+                                metric_page(m),
+                                process_metric,
+                                m,
+                                tpl_df,
+                                output,
+                                chart_df,
+                                spec.report_chart_points,
+                            ),
+                        )
+                    )
+
+            # all metrics of the group in one go
+            with timed("group summary"):
+                summary = group_summary(
                     df,
-                    output,
-                    metrics_by_group,
-                    spec.github_project,
-                    spec.report_num_commits,
+                    metrics,
+                    spec.report_sparkline_points,
+                    spec.report_compare_commits,
+                )
+            page = (group_url(group) / "index.html").as_posix()
+            key = content_hash(
+                base_key,
+                "group",
+                group,
+                str(spec.report_compare_commits),
+                pandas.util.hash_pandas_object(summary, index=False)
+                .to_numpy()
+                .tobytes(),
+            )
+            if not is_current(page, key):
+                tasks.append(
+                    (
+                        len(metrics),
+                        render_page,
+                        (
+                            page,
+                            process_group,
+                            group,
+                            summary,
+                            spec.report_compare_commits,
+                            output,
+                        ),
+                    )
                 )
-                for m in metrics
-            ]
-            for f in rich.progress.track(as_completed(futures), total=len(futures)):
-                metric = f.result()
-                print(metric.name)
-            msg.good(f"Completed group {group}")
-
-        # for metric in rich.progress.track(metrics):
-        #     process_metric(metric, df, output, env)
-
-        url = group_url(group)
-        page = output / url / "index.html"
 
-        with push_url(url):
-            page.write_text(group_tpl.render(group=group))
+    # largest first, so no big page starts last and holds up the publish
+    tasks.sort(key=lambda t: t[0], reverse=True)
+
+    with timed("render"):
+        if jobs > 1 and len(tasks) > 1:
+            ex: Executor
+            if render_mode == RenderMode.Threads:
+                # no pickling or worker startup, pages share the environment
+                ex = ThreadPoolExecutor(max_workers=jobs)
+            else:
+                ex = ProcessPoolExecutor(
+                    max_workers=jobs,
+                    initializer=init_worker,
+                    initargs=(metrics_by_group, spec.github_project),
+                )
+            result: Callable[[Future], Any]
+            with ex:
+                if render_mode == RenderMode.Threads:
+                    # each page renders in a copy of this context, with its own URL
+                    futures = [
+                        ex.submit(contextvars.copy_context().run, fn, *args)
+                        for _, fn, args in tasks
+                    ]
+                    result = Future.result
+                else:
+                    futures = [submit_timed(ex, fn, *args) for _, fn, args in tasks]
+                    result = timed_result
+                for f in rich.progress.track(
+                    as_completed(futures), total=len(futures), description="Rendering"
+                ):
+                    result(f)
+        else:
+            for _, fn, args in rich.progress.track(tasks, description="Rendering"):
+                fn(*args)
+
+    stale = [page for page in old_manifest if page not in manifest]
+    with timed("write manifest"):
+        remove_pages(output, stale)
+        # written last, an interrupted publish renders the remaining pages again
+        atomic_write(output / MANIFEST_FILE, json.dumps(manifest, indent=2))
+
+    rendered += len(tasks)
+    msg.good(
+        f"Rendered {rendered} page(s), skipped {len(manifest) - rendered} unchanged,"
+        f" removed {len(stale)} stale"
+    )
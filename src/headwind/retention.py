@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy
+import pandas
+from pydantic import BaseModel
+
+from headwind.graph import CommitGraph
+from headwind.spec import Retention, Thinning
+
+_bucket_days = {Thinning.Daily: 1, Thinning.Weekly: 7}
+
+
+class RetentionPlan(BaseModel):
+    # commits whose runs are removed
+    drop: List[str] = []
+    # kept commits that get a new parent, None for a new root
+    reparent: Dict[str, Optional[str]] = {}
+    # branches that are removed entirely
+    branches: List[str] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.drop or self.reparent or self.branches)
+
+
+def _to_utc(dates: numpy.ndarray) -> pandas.DatetimeIndex:
+    # naive dates are taken to be UTC
+    return pandas.DatetimeIndex(pandas.to_datetime(dates, utc=True, format="ISO8601"))
+
+
+def plan_retention(
+    graph: CommitGraph,
+    tips: Dict[str, str],
+    retention: Retention,
+    now: Optional[datetime] = None,
+) -> RetentionPlan:
+    """
+    Determine which runs to drop under ``retention``. Runs older than a
+    rule's age are thinned to the newest run per day or week. Branches not in
+    ``keep_branches`` whose tip is older than ``prune_branches_after`` days
+    are dropped entirely. Parent links of the remaining runs are rewritten to
+    their closest remaining ancestor.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    now_ts = pandas.Timestamp(now)
+    if now_ts.tzinfo is None:
+        now_ts = now_ts.tz_localize("UTC")
+
+    plan = RetentionPlan()
+
+    for branch, tip in tips.items():
+        rows = numpy.fromiter(graph.walk(tip), dtype=int)
+        if len(rows) == 0:
+            continue
+        dates = _to_utc(graph.date[rows])
+        age_days = ((now_ts - dates) / pandas.Timedelta(days=1)).to_numpy()
+
+        if (
+            retention.prune_branches_after is not None
+            and branch not in retention.keep_branches
+            and age_days[0] > retention.prune_branches_after
+        ):
+            plan.branches.append(branch)
+            plan.drop.extend(str(c) for c in graph.commit[rows])
+            continue
+
+        # the rule that applies to each run, -1 for none
+        rule = numpy.full(len(rows), -1)
+        for i, r in enumerate(retention.rules):
+            rule[age_days >= r.older_than] = i
+
+        epoch = pandas.Timestamp(0, tz="UTC")
+        epoch_days = ((dates - epoch) // pandas.Timedelta(days=1)).to_numpy()
+        bucket = numpy.zeros(len(rows), dtype=int)
+        for i, r in enumerate(retention.rules):
+            mask = rule == i
+            bucket[mask] = epoch_days[mask] // _bucket_days[r.keep]
+
+        keep = numpy.ones(len(rows), dtype=bool)
+        seen = set()
+        # rows are newest first, so the newest run in every bucket is kept
+        for j in range(len(rows)):
+            if rule[j] < 0:
+                continue
+            key = (rule[j], bucket[j])
+            if key in seen:
+                keep[j] = False
+            else:
+                seen.add(key)
+
+        kept = rows[keep]
+        plan.drop.extend(str(c) for c in graph.commit[rows[~keep]])
+        # whatever the oldest walked run pointed to, if anything
+        tail_parent = str(graph.parent[rows[-1]]) or None
+        for j, row in enumerate(kept):
+            parent = (
+                str(graph.commit[kept[j + 1]]) if j + 1 < len(kept) else tail_parent
+            )
+            current = str(graph.parent[row]) or None
+            if parent != current:
+                plan.reparent[str(graph.commit[row])] = parent
+
+    return plan
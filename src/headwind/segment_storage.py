@@ -0,0 +1,227 @@
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from headwind.locking import atomic_write
+from headwind.compression import compress, decompress
+from headwind.spec import Commit, Compression, Run
+from headwind.storage import Storage, load_run
+
+# index entry: segment number, offset, length
+_Entry = Tuple[int, int, int]
+
+
+class SegmentStorage(Storage):
+    """
+    Storage backend that appends runs as newline delimited JSON records to
+    rolling segment files. An append-only index maps each commit to the
+    location of its latest record, superseded records are dropped by
+    :meth:`compact`.
+    """
+
+    segment_dir: Path
+    segment_size: int
+
+    def __init__(
+        self,
+        base_dir: Path,
+        segment_size: int = 64 * 1024 * 1024,
+        compression: Compression = Compression.Off,
+    ) -> None:
+        super().__init__(base_dir, compression=compression)
+        self.segment_dir = self.base_dir / "segments"
+        self.segment_dir.mkdir(exist_ok=True)
+        self.segment_size = segment_size
+        self._index_cache: Optional[Tuple[Tuple[int, int, int], Dict[str, _Entry]]]
+        self._index_cache = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # sync batches carry their index entries, workers need no index
+        state = self.__dict__.copy()
+        state["_index_cache"] = None
+        return state
+
+    @property
+    def _index_file(self) -> Path:
+        return self.segment_dir / "index.tsv"
+
+    def _segment_file(self, segment: int) -> Path:
+        return self.segment_dir / f"{segment:08d}.ndjson"
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(f.stem) for f in self.segment_dir.iterdir() if f.suffix == ".ndjson"
+        )
+
+    def _read_index(self) -> Dict[str, _Entry]:
+        """
+        The live index entries by commit. The parsed index is kept until the
+        index file changes, so it must not be modified.
+        """
+        index: Dict[str, _Entry] = {}
+        try:
+            st = self._index_file.stat()
+        except FileNotFoundError:
+            return index
+        # appends change the size, compaction replaces the file
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._index_cache is not None and self._index_cache[0] == stamp:
+            return self._index_cache[1]
+
+        with self._index_file.open("r") as fh:
+            for line in fh:
+                fields = line.split()
+                if len(fields) != 4:
+                    # partial line from an interrupted writer
+                    continue
+                commit, segment, offset, length = fields
+                # later entries supersede earlier ones
+                if int(segment) < 0:
+                    index.pop(commit, None)
+                else:
+                    index[commit] = (int(segment), int(offset), int(length))
+        self._index_cache = (stamp, index)
+        return index
+
+    @staticmethod
+    def _index_line(commit: str, entry: _Entry) -> str:
+        return f"{commit}\t{entry[0]}\t{entry[1]}\t{entry[2]}\n"
+
+    def _append(
+        self, records: List[Tuple[str, bytes]], segment: int
+    ) -> Dict[str, _Entry]:
+        """
+        Append ``records`` to the segments starting at ``segment``, rolling
+        over to a new segment once it exceeds the segment size.
+        """
+        entries = {}
+        fh = self._segment_file(segment).open("ab")
+        try:
+            for commit, record in records:
+                offset = fh.tell()
+                if offset > 0 and offset + len(record) > self.segment_size:
+                    fh.close()
+                    segment += 1
+                    fh = self._segment_file(segment).open("ab")
+                    offset = fh.tell()
+                fh.write(record)
+                entries[commit] = (segment, offset, len(record))
+        finally:
+            fh.close()
+        return entries
+
+    def _write_run(self, run: Run) -> Tuple[str, List[Any]]:
+        segments = self._segments()
+        record = compress((run.json() + "\n").encode("utf8"), self.compression)
+        entries = self._append(
+            [(run.commit.hash, record)], segments[-1] if segments else 1
+        )
+        entry = entries[run.commit.hash]
+        with self._index_file.open("a") as fh:
+            fh.write(self._index_line(run.commit.hash, entry))
+        return run.commit.hash, list(entry)
+
+    def _delete_run(self, commit: str) -> None:
+        # tombstone, the record itself is dropped by compact()
+        with self._index_file.open("a") as fh:
+            fh.write(self._index_line(commit, (-1, 0, 0)))
+
+    def _sources(self) -> Dict[str, List[Any]]:
+        return {commit: list(entry) for commit, entry in self._read_index().items()}
+
+    def _read_record(self, entry: _Entry) -> Run:
+        segment, offset, length = entry
+        with self._segment_file(segment).open("rb") as fh:
+            fh.seek(offset)
+            return load_run(decompress(fh.read(length)))
+
+    def _load_source(self, name: str) -> Run:
+        return self._read_record(self._read_index()[name])
+
+    def _load_sources(self, sources: Dict[str, List[Any]]) -> List[Tuple[str, Run]]:
+        # the stamps are the index entries, no need to read the index again
+        entries = ((commit, (s[0], s[1], s[2])) for commit, s in sources.items())
+        return [
+            (commit, load_run(decompress(record)))
+            for commit, record in self._iterate_records(entries)
+        ]
+
+    def get(self, commit: Commit) -> Run:
+        index = self._read_index()
+        assert commit.hash in index
+        return self._read_record(index[commit.hash])
+
+    def _iterate_records(
+        self, entries: Optional[Iterable[Tuple[str, _Entry]]] = None
+    ) -> Iterator[Tuple[str, bytes]]:
+        """
+        Read the records of ``entries``, all live records by default, segment
+        by segment in storage order
+        """
+        if entries is None:
+            entries = self._read_index().items()
+        by_segment: Dict[int, List[Tuple[int, int, str]]] = {}
+        for commit, (segment, offset, length) in entries:
+            by_segment.setdefault(segment, []).append((offset, length, commit))
+
+        for segment in sorted(by_segment):
+            with self._segment_file(segment).open("rb") as fh:
+                for offset, length, commit in sorted(by_segment[segment]):
+                    fh.seek(offset)
+                    yield commit, fh.read(length)
+
+    def iterate_all(self) -> Iterator[Run]:
+        # in commit order, batches of records are read segment by segment
+        entries = sorted(self._read_index().items())
+        for i in range(0, len(entries), 1000):
+            batch = entries[i : i + 1000]
+            records = dict(self._iterate_records(batch))
+            for commit, _ in batch:
+                yield load_run(decompress(records[commit]))
+
+    def num_runs(self) -> int:
+        return len(self._read_index())
+
+    def compact(self) -> int:
+        """
+        Rewrite the live records into fresh segments, in the configured
+        compression, and drop superseded records. Returns the number of
+        records dropped.
+        """
+        with self._lock:
+            return self._compact()
+
+    def migrate(self) -> int:
+        self.compact()
+        return self.num_runs()
+
+    def _compact(self) -> int:
+        if not self._index_file.exists():
+            return 0
+        old_segments = self._segments()
+        with self._index_file.open("r") as fh:
+            num_records = sum(1 for line in fh if "\t-1\t" not in line)
+
+        records = [
+            (commit, compress(decompress(record), self.compression))
+            for commit, record in self._iterate_records()
+        ]
+        first = old_segments[-1] + 1 if old_segments else 1
+        entries = self._append(records, first) if records else {}
+
+        atomic_write(
+            self._index_file,
+            "".join(self._index_line(c, entry) for c, entry in entries.items()),
+        )
+
+        for segment in old_segments:
+            self._segment_file(segment).unlink()
+
+        if self.columns.exists():
+            # payloads moved but did not change, no need to parse them again
+            sources = self.columns.sources()
+            for commit, entry in entries.items():
+                if commit in sources:
+                    sources[commit] = list(entry) + [commit]
+            self.columns.update([], sources=sources)
+
+        return num_records - len(records)
@@ -5,12 +5,22 @@ from typing import Any, Dict, IO, List, Optional, cast, Callable
 import textwrap
 
 from pydantic import BaseModel, validator, Field, root_validator
+from pydantic.datetime_parse import parse_datetime
 import pydantic
 import json
 import yaml
 import pandas
 
 
+def _parse_datetime(value: Any) -> datetime:
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return cast(datetime, parse_datetime(value))
+
+
 class CollectorType(str, Enum):
     Python = "python"
     Command = "command"
@@ -39,6 +49,60 @@ class Metric(BaseModel):
     def __hash__(self):
         return hash(self.name)
 
+    @classmethod
+    def from_trusted(cls, data: Dict[str, Any]) -> "Metric":
+        value = data["value"]
+        return cls.construct(
+            name=data["name"],
+            group=data.get("group"),
+            value=float(value) if value is not None else None,
+            unit=data["unit"],
+        )
+
+
+class StorageBackend(str, Enum):
+    Files = "files"
+    Sqlite = "sqlite"
+    Segments = "segments"
+
+
+class Compression(str, Enum):
+    Off = "none"
+    Gzip = "gzip"
+    Bz2 = "bz2"
+    Lzma = "lzma"
+
+
+class StorageLayout(str, Enum):
+    Flat = "flat"
+    Sharded = "sharded"
+
+
+class Thinning(str, Enum):
+    Daily = "daily"
+    Weekly = "weekly"
+
+
+class RetentionRule(BaseModel):
+    older_than: int = Field(..., gt=0, description="Age in days")
+    keep: Thinning
+
+    class Config:
+        extra = "forbid"
+
+
+class Retention(BaseModel):
+    rules: List[RetentionRule] = []
+    prune_branches_after: Optional[int] = Field(None, gt=0, description="Days")
+    keep_branches: List[str] = ["main", "master"]
+
+    class Config:
+        extra = "forbid"
+
+    @validator("rules")
+    def sort_rules(cls, v: List[RetentionRule], **kwargs: Any) -> List[RetentionRule]:
+        return sorted(v, key=lambda r: r.older_than)
+
 
 class ReportFilter:
     fn: Optional[Callable[[Metric, pandas.DataFrame], bool]]
@@ -67,9 +131,23 @@ class Spec(BaseModel):
     collectors: List[CollectorModel]
     spec_file: Path
     storage_dir: Path
+    storage_backend: StorageBackend = StorageBackend.Files
+    storage_compression: Compression = Compression.Off
+    storage_layout: StorageLayout = StorageLayout.Flat
     report_filter: ReportFilter = ReportFilter(None)
     github_project: Optional[str] = None
+    # commits per branch in the tables of the metric pages
     report_num_commits: int = 100
+    # commits per branch in the charts and in change detection, None for the
+    # same commits as the tables
+    report_chart_commits: Optional[int] = None
+    # points per chart, longer series are downsampled
+    report_chart_points: Optional[int] = 1000
+    # group pages: sparkline length, and how many commits back the newest
+    # value is compared to
+    report_sparkline_points: int = 30
+    report_compare_commits: int = 10
+    retention: Optional[Retention] = None
 
     class Config:
         extra = "forbid"
@@ -81,6 +159,12 @@ class Spec(BaseModel):
         assert len(v) > 0, "At least one collector needs to be given."
         return v
 
+    @validator("report_chart_points")
+    def chart_points_min(cls, v: Optional[int], **kwargs: Any) -> Optional[int]:
+        if v is not None:
+            assert v >= 4, "At least 4 chart points are needed"
+        return v
+
     @root_validator
     def root_validator(slc, values: Dict[str, Any]):
         assert "spec_file" in values
@@ -123,6 +207,14 @@ class Commit(BaseModel):
     hash: str = Field(min_length=40, max_length=40)
     message: str
 
+    @classmethod
+    def from_trusted(cls, data: Dict[str, Any]) -> "Commit":
+        return cls.construct(
+            date=_parse_datetime(data["date"]),
+            hash=data["hash"],
+            message=data["message"],
+        )
+
     def __str__(self) -> str:
         return f'Commit(date={self.date:%Y-%m-%dT%H:%M:%S}, hash={self.hash[:8]}, message="{self.message}")'
 
@@ -149,3 +241,19 @@ class Run(BaseModel):
         names = set(m.name for m in v)
         assert len(names) == len(v), "Metrics have duplicate names"
         return v
+
+    @classmethod
+    def from_trusted(cls, data: Dict[str, Any]) -> "Run":
+        """
+        Build a run from data that headwind wrote itself, and therefore
+        validated before, without running the validators again.
+        """
+        parent = data.get("parent")
+        return cls.construct(
+            commit=Commit.from_trusted(data["commit"]),
+            parent=Commit.from_trusted(parent) if parent is not None else None,
+            branch=data["branch"],
+            date=_parse_datetime(data["date"]),
+            results=[Metric.from_trusted(m) for m in data["results"]],
+            context=data.get("context", {}),
+        )
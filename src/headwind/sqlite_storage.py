@@ -0,0 +1,512 @@
+import contextlib
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+import numpy
+import pandas
+
+from headwind.catalog import MetricInfo
+from headwind.graph import CommitGraph
+from headwind.retention import RetentionPlan, plan_retention
+from headwind.spec import Commit, Metric, Retention, Run
+from headwind.storage import Storage, make_frame
+from headwind.timing import timed
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (
+    hash TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    commit_hash TEXT PRIMARY KEY REFERENCES commits(hash),
+    parent_hash TEXT REFERENCES commits(hash),
+    branch TEXT NOT NULL,
+    date TEXT NOT NULL,
+    context TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_branch ON runs(branch);
+CREATE INDEX IF NOT EXISTS runs_parent ON runs(parent_hash);
+CREATE TABLE IF NOT EXISTS branches (
+    name TEXT PRIMARY KEY,
+    tip TEXT NOT NULL REFERENCES commits(hash)
+);
+CREATE TABLE IF NOT EXISTS results (
+    commit_hash TEXT NOT NULL REFERENCES runs(commit_hash) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    grp TEXT,
+    unit TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (commit_hash, name)
+);
+CREATE INDEX IF NOT EXISTS results_name ON results(name);
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT PRIMARY KEY,
+    grp TEXT,
+    unit TEXT NOT NULL,
+    first_commit TEXT NOT NULL,
+    last_commit TEXT NOT NULL,
+    num_runs INTEGER NOT NULL
+);
+"""
+
+# fills the metric catalog of databases that predate it
+_BACKFILL_METRICS = """
+INSERT INTO metrics (name, grp, unit, first_commit, last_commit, num_runs)
+SELECT s.name, s.grp, s.unit,
+    (SELECT s2.commit_hash FROM results s2
+        JOIN runs r ON r.commit_hash = s2.commit_hash
+        WHERE s2.name = s.name ORDER BY r.date ASC LIMIT 1),
+    (SELECT s2.commit_hash FROM results s2
+        JOIN runs r ON r.commit_hash = s2.commit_hash
+        WHERE s2.name = s.name ORDER BY r.date DESC LIMIT 1),
+    count(*)
+FROM results s
+WHERE NOT EXISTS (SELECT 1 FROM metrics)
+GROUP BY s.name
+"""
+
+
+class SqliteStorage(Storage):
+    """
+    Storage backend that keeps runs, commits, branch tips and metric values in
+    a single indexed SQLite database inside the storage directory.
+    """
+
+    db_file: Path
+
+    def __init__(self, base_dir: Path) -> None:
+        super().__init__(base_dir)
+        self.db_file = self.base_dir / "headwind.sqlite"
+        with self._connect() as con:
+            con.executescript(_SCHEMA)
+            con.execute(_BACKFILL_METRICS)
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        con = sqlite3.connect(self.db_file, timeout=60, isolation_level=None)
+        try:
+            con.execute("PRAGMA foreign_keys = ON")
+            yield con
+        finally:
+            con.close()
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as con:
+            # take the write lock up front, so concurrent writers serialize
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                yield con
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+
+    @staticmethod
+    def _insert_commit(con: sqlite3.Connection, commit: Commit) -> None:
+        con.execute(
+            "INSERT INTO commits (hash, date, message) VALUES (?, ?, ?)"
+            " ON CONFLICT (hash) DO UPDATE"
+            " SET date = excluded.date, message = excluded.message",
+            (commit.hash, commit.date.isoformat(), commit.message),
+        )
+
+    def _insert_run(self, con: sqlite3.Connection, run: Run) -> None:
+        self._insert_commit(con, run.commit)
+        # a run replacing an earlier one for the same commit
+        con.execute(
+            "UPDATE metrics SET num_runs = num_runs - 1 WHERE name IN"
+            " (SELECT name FROM results WHERE commit_hash = ?)",
+            (run.commit.hash,),
+        )
+        con.execute("DELETE FROM runs WHERE commit_hash = ?", (run.commit.hash,))
+        con.execute(
+            "INSERT INTO runs (commit_hash, parent_hash, branch, date, context)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                run.commit.hash,
+                run.parent.hash if run.parent is not None else None,
+                run.branch,
+                run.date.isoformat(),
+                json.dumps(run.context),
+            ),
+        )
+        con.executemany(
+            "INSERT INTO results (commit_hash, position, name, grp, unit, value)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (run.commit.hash, i, m.name, m.group, m.unit, m.value)
+                for i, m in enumerate(run.results)
+            ],
+        )
+        con.executemany(
+            "INSERT INTO metrics"
+            " (name, grp, unit, first_commit, last_commit, num_runs)"
+            " VALUES (?, ?, ?, ?, ?, 1)"
+            " ON CONFLICT (name) DO UPDATE SET grp = excluded.grp,"
+            " unit = excluded.unit, last_commit = excluded.last_commit,"
+            " num_runs = num_runs + 1",
+            [
+                (m.name, m.group, m.unit, run.commit.hash, run.commit.hash)
+                for m in run.results
+            ],
+        )
+
+    def store_runs(self, runs: List[Run]) -> None:
+        with self._transaction() as con:
+            tips: Dict[str, Optional[Commit]] = {}
+            for run in runs:
+                if run.branch not in tips:
+                    tips[run.branch] = self._get_branch_tip(con, run.branch)
+                run.parent = tips[run.branch]
+                self._insert_run(con, run)
+                tips[run.branch] = run.commit
+
+            con.executemany(
+                "INSERT OR REPLACE INTO branches (name, tip) VALUES (?, ?)",
+                {run.branch: run.commit.hash for run in runs}.items(),
+            )
+
+    @staticmethod
+    def _make_commit(row: Tuple[str, str, str]) -> Commit:
+        return Commit.from_trusted({"hash": row[0], "date": row[1], "message": row[2]})
+
+    def _load_runs(
+        self, con: sqlite3.Connection, where: str = "", params: Tuple[Any, ...] = ()
+    ) -> List[Run]:
+        rows = con.execute(
+            "SELECT r.commit_hash, c.date, c.message,"
+            " p.hash, p.date, p.message, r.branch, r.date, r.context"
+            " FROM runs r"
+            " JOIN commits c ON c.hash = r.commit_hash"
+            " LEFT JOIN commits p ON p.hash = r.parent_hash"
+            f" {where} ORDER BY r.commit_hash",
+            params,
+        ).fetchall()
+
+        results: Dict[str, List[Metric]] = {row[0]: [] for row in rows}
+        for commit_hash, name, grp, unit, value in con.execute(
+            "SELECT s.commit_hash, s.name, s.grp, s.unit, s.value"
+            " FROM results s JOIN runs r ON r.commit_hash = s.commit_hash"
+            f" {where} ORDER BY s.commit_hash, s.position",
+            params,
+        ):
+            results[commit_hash].append(
+                Metric.from_trusted(
+                    {"name": name, "group": grp, "unit": unit, "value": value}
+                )
+            )
+
+        # rows were validated when they were stored
+        return [
+            Run.construct(
+                commit=self._make_commit(row[0:3]),
+                parent=self._make_commit(row[3:6]) if row[3] is not None else None,
+                branch=row[6],
+                date=datetime.fromisoformat(row[7]),
+                results=results[row[0]],
+                context=json.loads(row[8]),
+            )
+            for row in rows
+        ]
+
+    def get(self, commit: Commit) -> Run:
+        with self._connect() as con:
+            runs = self._load_runs(con, "WHERE r.commit_hash = ?", (commit.hash,))
+        assert len(runs) == 1
+        return runs[0]
+
+    def iterate_all(self) -> Iterator[Run]:
+        # a page of commits at a time, the pages are ranges of commit hashes
+        with self._connect() as con:
+            commits = con.execute("SELECT commit_hash FROM runs ORDER BY commit_hash")
+            for page in iter(lambda: commits.fetchmany(1000), []):
+                yield from self._load_runs(
+                    con,
+                    "WHERE r.commit_hash BETWEEN ? AND ?",
+                    (page[0][0], page[-1][0]),
+                )
+
+    def iterate_columns(
+        self, metrics: List[str], chunk_size: int
+    ) -> Iterator[Dict[str, numpy.ndarray]]:
+        with self._connect() as con:
+            keys = con.execute(
+                "SELECT r.commit_hash, coalesce(r.parent_hash, ''), r.branch,"
+                " c.date, c.message"
+                " FROM runs r JOIN commits c ON c.hash = r.commit_hash"
+                " ORDER BY r.commit_hash"
+            )
+            for rows in iter(lambda: keys.fetchmany(chunk_size), []):
+                data = {
+                    name: numpy.array(column, dtype=object)
+                    for name, column in zip(
+                        ("commit", "parent", "branch", "date", "message"), zip(*rows)
+                    )
+                }
+                values = pandas.read_sql_query(
+                    "SELECT commit_hash, name, value FROM results"
+                    " WHERE commit_hash BETWEEN ? AND ?",
+                    con,
+                    params=(rows[0][0], rows[-1][0]),
+                )
+                wide = values.pivot(index="commit_hash", columns="name", values="value")
+                wide = wide.reindex(index=data["commit"], columns=metrics)
+                for name in metrics:
+                    data[name] = wide[name].to_numpy(dtype=float)
+                yield data
+
+    @staticmethod
+    def _get_branch_tip(con: sqlite3.Connection, branch: str) -> Optional[Commit]:
+        row = con.execute(
+            "SELECT c.hash, c.date, c.message FROM branches b"
+            " JOIN commits c ON c.hash = b.tip WHERE b.name = ?",
+            (branch,),
+        ).fetchone()
+        if row is None:
+            return None
+        return SqliteStorage._make_commit(row)
+
+    def get_branch_tip(self, branch: str) -> Optional[Commit]:
+        with self._connect() as con:
+            return self._get_branch_tip(con, branch)
+
+    def get_branches(self) -> List[str]:
+        with self._connect() as con:
+            return [r[0] for r in con.execute("SELECT name FROM branches")]
+
+    def find_branch_tips_slow(self) -> Dict[str, Commit]:
+        # runs that are nobody's parent
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT r.branch, c.hash, c.date, c.message FROM runs r"
+                " JOIN commits c ON c.hash = r.commit_hash"
+                " WHERE NOT EXISTS"
+                " (SELECT 1 FROM runs r2 WHERE r2.parent_hash = r.commit_hash)"
+            ).fetchall()
+        return {row[0]: self._make_commit(row[1:]) for row in rows}
+
+    def iterate(self, start: Commit, limit: Optional[int] = None) -> Iterator[Run]:
+        if limit == 0:
+            return
+        with self._connect() as con:
+            if limit is None:
+                # longer chains than there are runs contain a cycle
+                limit = int(con.execute("SELECT count(*) FROM runs").fetchone()[0]) + 1
+            con.execute(
+                "CREATE TEMP TABLE chain AS WITH RECURSIVE walk(hash, depth) AS ("
+                " SELECT commit_hash, 0 FROM runs WHERE commit_hash = ?"
+                " UNION ALL"
+                " SELECT p.commit_hash, walk.depth + 1 FROM walk"
+                " JOIN runs r ON r.commit_hash = walk.hash"
+                " JOIN runs p ON p.commit_hash = r.parent_hash"
+                " WHERE walk.depth + 1 < ?"
+                ") SELECT hash, depth FROM walk",
+                (start.hash, limit),
+            )
+            hashes = [
+                r[0] for r in con.execute("SELECT hash FROM chain ORDER BY depth")
+            ]
+            assert len(hashes) > 0, f"No run for commit {start.hash}"
+            seen: Set[str] = set()
+            for h in hashes:
+                if h in seen:
+                    raise RuntimeError(f"Cycle in commit sequence detected: \n{h}")
+                seen.add(h)
+
+            # a page of the history at a time, newest first
+            for first in range(0, len(hashes), 1000):
+                page = hashes[first : first + 1000]
+                runs = {
+                    run.commit.hash: run
+                    for run in self._load_runs(
+                        con,
+                        "WHERE r.commit_hash IN"
+                        " (SELECT hash FROM chain WHERE depth BETWEEN ? AND ?)",
+                        (first, first + len(page) - 1),
+                    )
+                }
+                for h in page:
+                    yield runs[h]
+
+    def gc(self, retention: Retention, now: Optional[datetime] = None) -> RetentionPlan:
+        # the transaction holds the write lock while planning
+        with self._transaction() as con:
+            tips = dict(con.execute("SELECT name, tip FROM branches"))
+            graph = CommitGraph.from_columns(self._load_columns(con))
+            plan = plan_retention(graph, tips, retention, now)
+            if plan:
+                self._apply_retention(con, plan)
+        return plan
+
+    def apply_retention(self, plan: RetentionPlan) -> None:
+        with self._transaction() as con:
+            self._apply_retention(con, plan)
+
+    @staticmethod
+    def _apply_retention(con: sqlite3.Connection, plan: RetentionPlan) -> None:
+        con.executemany(
+            "UPDATE runs SET parent_hash = ? WHERE commit_hash = ?",
+            [(parent, commit) for commit, parent in plan.reparent.items()],
+        )
+        con.executemany(
+            "DELETE FROM runs WHERE commit_hash = ?", [(c,) for c in plan.drop]
+        )
+        con.executemany(
+            "DELETE FROM branches WHERE name = ?", [(b,) for b in plan.branches]
+        )
+        con.execute(
+            "DELETE FROM commits WHERE hash NOT IN"
+            " (SELECT commit_hash FROM runs) AND hash NOT IN"
+            " (SELECT parent_hash FROM runs WHERE parent_hash IS NOT NULL)"
+        )
+        con.execute("DELETE FROM metrics")
+        con.execute(_BACKFILL_METRICS)
+
+    def migrate(self) -> int:
+        # runs are rows, there are no files to recompress
+        return 0
+
+    def catalog(self) -> Dict[str, MetricInfo]:
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT name, grp, unit, first_commit, last_commit, num_runs"
+                " FROM metrics"
+            ).fetchall()
+        return {
+            row[0]: MetricInfo(
+                name=row[0],
+                group=row[1],
+                unit=row[2],
+                first_commit=row[3],
+                last_commit=row[4],
+                num_runs=row[5],
+            )
+            for row in rows
+        }
+
+    @staticmethod
+    def _load_columns(con: sqlite3.Connection) -> Dict[str, numpy.ndarray]:
+        keys = pandas.read_sql_query(
+            "SELECT r.commit_hash AS 'commit',"
+            " coalesce(r.parent_hash, '') AS parent, r.branch, c.date, c.message"
+            " FROM runs r JOIN commits c ON c.hash = r.commit_hash",
+            con,
+        )
+        return {k: keys[k].to_numpy(dtype=str) for k in keys.columns}
+
+    def graph(self) -> CommitGraph:
+        with self._connect() as con:
+            return CommitGraph.from_columns(self._load_columns(con))
+
+    def dataframe(
+        self,
+        with_metrics: bool = False,
+        progress_callback: Optional[Callable[[], None]] = None,
+        jobs: int = 1,
+    ) -> Union[pandas.DataFrame, Tuple[pandas.DataFrame, Dict[str, List[Metric]]]]:
+        # everything comes out of two queries, no need for parallelism
+        with self._connect() as con:
+            data = self._load_columns(con)
+            values = pandas.read_sql_query(
+                "SELECT commit_hash, name, value FROM results", con
+            )
+
+        wide = values.pivot(index="commit_hash", columns="name", values="value")
+        wide = wide.reindex(data["commit"])
+        for name in wide.columns:
+            data[name] = wide[name].to_numpy(dtype=float)
+
+        metrics = [m for ms in self.get_metrics().values() for m in ms]
+        if progress_callback is not None:
+            for _ in range(len(data["commit"])):
+                progress_callback()
+        return self._make_dataframe(data, metrics, with_metrics)
+
+    def query(
+        self,
+        metrics: Optional[Iterable[str]] = None,
+        branches: Optional[Iterable[str]] = None,
+        since: Optional[datetime] = None,
+        limit_per_branch: Optional[int] = None,
+        progress_callback: Optional[Callable[[], None]] = None,
+        jobs: int = 1,
+    ) -> pandas.DataFrame:
+        if metrics is None:
+            metrics = [m.name for ms in self.get_metrics().values() for m in ms]
+        metrics = list(metrics)
+        # same branch order as dataframe()
+        tips = {b: c.hash for b, c in self.find_branch_tips().items()}
+
+        with self._connect() as con:
+            keys = pandas.read_sql_query(
+                "SELECT r.commit_hash AS 'commit',"
+                " coalesce(r.parent_hash, '') AS parent, r.branch, c.date"
+                " FROM runs r JOIN commits c ON c.hash = r.commit_hash",
+                con,
+            )
+            data = {k: keys[k].to_numpy(dtype=str) for k in keys.columns}
+            if branches is not None:
+                tips = {b: tips[b] for b in branches if b in tips}
+            with timed("select commits"):
+                take = CommitGraph.from_columns(data).select(
+                    tips.values(), since, limit_per_branch
+                )
+
+            # only the selected rows are read from here on
+            con.execute("CREATE TEMP TABLE selected (hash TEXT PRIMARY KEY)")
+            con.executemany(
+                "INSERT OR IGNORE INTO selected VALUES (?)",
+                [(h,) for h in data["commit"][take]],
+            )
+            messages = dict(
+                con.execute(
+                    "SELECT c.hash, c.message FROM commits c"
+                    " JOIN selected s ON s.hash = c.hash"
+                )
+            )
+            known = {r[0] for r in con.execute("SELECT name FROM metrics")}
+            for name in metrics:
+                if name not in known:
+                    raise KeyError(f"Unknown metric {name}")
+            values = pandas.read_sql_query(
+                "SELECT r.commit_hash, r.name, r.value FROM results r"
+                " JOIN selected s ON s.hash = r.commit_hash"
+                f" WHERE r.name IN ({', '.join('?' * len(metrics))})",
+                con,
+                params=metrics,
+            )
+
+        data["message"] = numpy.array(
+            [messages.get(h, "") for h in data["commit"]], dtype=str
+        )
+        wide = values.pivot(index="commit_hash", columns="name", values="value")
+        wide = wide.reindex(index=data["commit"], columns=metrics)
+        for name in metrics:
+            data[name] = wide[name].to_numpy(dtype=float)
+
+        if progress_callback is not None:
+            for _ in range(len(data["commit"])):
+                progress_callback()
+        with timed("make frame"):
+            return make_frame(data, take, metrics)
+
+    def num_runs(self) -> int:
+        with self._connect() as con:
+            return int(con.execute("SELECT count(*) FROM runs").fetchone()[0])
@@ -1,19 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import contextlib
 import json
+import math
+import os
 import re
+from datetime import datetime
 from pathlib import Path
-from typing import Iterator, Dict, List, Optional, Tuple, Union, Callable
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    Callable,
+)
 
+import numpy
 import pandas
 
-from headwind.spec import Metric, Run, Commit
+try:
+    import orjson
+
+    _json_loads: Callable[[Union[str, bytes]], Any] = orjson.loads
+except ImportError:  # pragma: no cover
+    _json_loads = json.loads
+
+from headwind.catalog import MetricCatalog, MetricInfo
+from headwind.compression import SUFFIXES, compress, decompress, suffix
+from headwind.columns import ColumnBatch, ColumnStore
+from headwind.graph import CommitGraph
+from headwind.locking import FileLock, atomic_write
+from headwind.retention import RetentionPlan, plan_retention
+from headwind.spec import (
+    Compression,
+    Metric,
+    Retention,
+    Run,
+    Commit,
+    Spec,
+    StorageBackend,
+    StorageLayout,
+)
+from headwind.timing import submit_timed, timed, timed_result
+
+
+def load_run(raw: Union[str, bytes]) -> Run:
+    """
+    Parse a run that was serialized by headwind. Skips validation, which
+    already happened when the run was stored.
+    """
+    return Run.from_trusted(_json_loads(raw))
+
+
+def _parse_dates(values: numpy.ndarray) -> pandas.Series:
+    try:
+        return pandas.Series(pandas.to_datetime(values, format="ISO8601"))
+    except ValueError:
+        # mixed UTC offsets: keep the timezone aware datetimes as objects
+        return pandas.Series([datetime.fromisoformat(v) for v in values], dtype=object)
 
 
 class Storage:
+    """
+    Runs stored as one JSON file per commit. In the flat layout, run files
+    and ``branch_<name>.json`` tip files share the storage directory. The
+    sharded layout puts runs into ``runs/<prefix>/`` subdirectories, keyed by
+    the first characters of the file name, and tips into ``branches/``.
+    Both layouts are always read, :meth:`migrate` moves files between them.
+    """
+
     base_dir: Path
+    compression: Compression
+    layout: StorageLayout
+    columns: ColumnStore
+
+    # files in the storage directory that are not runs
+    _reserved_files = ("catalog.json",)
+    _shard_prefix = 2
 
-    def __init__(self, base_dir: Path) -> None:
+    def __init__(
+        self,
+        base_dir: Path,
+        compression: Compression = Compression.Off,
+        layout: StorageLayout = StorageLayout.Flat,
+    ) -> None:
         self.base_dir = base_dir
+        self.compression = compression
+        self.layout = layout
         assert self.base_dir.exists(), "Storage directory does not exist"
+        self.columns = ColumnStore(self.base_dir / "columns")
+        self._catalog = MetricCatalog(self.base_dir / "catalog.json")
+        self._lock = FileLock(self.base_dir / ".lock")
+        # nesting of synced() blocks, and whether the block synced already
+        self._sync_depth = 0
+        self._synced = False
 
     @staticmethod
     def _make_filename(commit: Commit) -> str:
@@ -21,43 +104,359 @@ class Storage:
         return f"{commit.hash}.json"
 
     def store_run(self, run: Run) -> None:
-        tip = self.get_branch_tip(run.branch)
-        run.parent = tip
-        filename = self._make_filename(run.commit)
-        target_file = self.base_dir / filename
+        self.store_runs([run])
 
-        with target_file.open("w") as fh:
-            fh.write(run.json(indent=2))
+    def store_runs(self, runs: List[Run]) -> None:
+        """
+        Store ``runs`` in order, each run's parent is the previous run on its
+        branch. Branch tips, the column store and the catalog are read and
+        written once for the whole batch.
+        """
+        # concurrent writers on the same branch would lose parent links
+        with self._lock:
+            tips: Dict[str, Optional[Commit]] = {}
+            sources = self.columns.sources()
+            # runs replacing stored ones must not be counted twice
+            commits = [run.commit.hash for run in runs]
+            known = {entry[-1] for entry in sources.values()}
+            replaced = len(set(commits)) < len(commits) or not known.isdisjoint(commits)
+            for run in runs:
+                if run.branch not in tips:
+                    tips[run.branch] = self.get_branch_tip(run.branch)
+                run.parent = tips[run.branch]
+                name, stamp = self._write_run(run)
+                sources[name] = stamp + [run.commit.hash]
+                tips[run.branch] = run.commit
 
-        with self._get_branch_file(run.branch).open("w") as fh:
-            fh.write(run.commit.json(indent=2))
+            for branch, tip in {run.branch: run.commit for run in runs}.items():
+                branch_file, *others = self._branch_file_variants(branch)
+                branch_file.parent.mkdir(exist_ok=True)
+                atomic_write(branch_file, tip.json(indent=2))
+                for other in others:
+                    other.unlink(missing_ok=True)
 
-    def get(self, commit: Commit) -> Run:
+            if self.columns.exists():
+                self.columns.update(runs, sources=sources)
+
+            if self._catalog.exists() and not replaced:
+                self._catalog.add_runs(runs)
+            else:
+                # counts of replaced runs changed, rebuild from the column store
+                self._catalog.file.unlink(missing_ok=True)
+
+        if not self._catalog.exists():
+            # syncs the column store first if there is none yet, other
+            # writers do not have to wait for that
+            self.catalog()
+
+    @property
+    def _runs_dir(self) -> Path:
+        return self.base_dir / "runs"
+
+    @property
+    def _branches_dir(self) -> Path:
+        return self.base_dir / "branches"
+
+    def _layouts(self) -> List[StorageLayout]:
+        # the configured layout first
+        return [self.layout] + [lo for lo in StorageLayout if lo != self.layout]
+
+    def _run_path(self, filename: str, layout: StorageLayout) -> Path:
+        if layout == StorageLayout.Sharded:
+            return self._runs_dir / filename[: self._shard_prefix] / filename
+        return self.base_dir / filename
+
+    def _run_file_variants(self, commit: Commit) -> List[Path]:
+        """
+        Possible files of the run for ``commit``, the configured layout and
+        compression first
+        """
         filename = self._make_filename(commit)
-        file = self.base_dir / filename
-        assert file.exists()
-        with file.open("r") as fh:
-            return Run(**json.load(fh))
-            # return Run(**yaml.safe_load(fh.read()))
+        suffixes = [suffix(self.compression)]
+        suffixes += [s for s in ("",) + SUFFIXES if s not in suffixes]
+        return [
+            self._run_path(filename + s, layout)
+            for layout in self._layouts()
+            for s in suffixes
+        ]
 
-    def iterate_all(self) -> Iterator[Run]:
-        for f in sorted(self.base_dir.iterdir()):
-            if not f.is_file():
-                continue
-            if f.name.startswith("branch_"):
+    def _source_name(self, file: Path) -> str:
+        return file.relative_to(self.base_dir).as_posix()
+
+    def _write_run(self, run: Run) -> Tuple[str, List[Any]]:
+        """
+        Write the payload of ``run``, returns the source name and its stamp
+        """
+        target_file, *others = self._run_file_variants(run.commit)
+        target_file.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.compression == Compression.Off:
+            atomic_write(target_file, run.json(indent=2))
+        else:
+            # no indentation, the compressor deals with repetition better
+            atomic_write(
+                target_file, compress(run.json().encode("utf8"), self.compression)
+            )
+
+        for other in others:
+            other.unlink(missing_ok=True)
+
+        return self._source_name(target_file), self._stamp(target_file)
+
+    def _delete_run(self, commit: str) -> None:
+        for f in self._run_file_variants(Commit.construct(hash=commit)):
+            f.unlink(missing_ok=True)
+
+    def migrate(self) -> int:
+        """
+        Move all runs and branch tips that are not stored in the configured
+        layout, and rewrite runs that are not stored with the configured
+        compression. Returns the number of runs moved or rewritten.
+        """
+        n = 0
+        with self._lock:
+            sources = self.columns.sources()
+            for f in sorted(self._run_files(), key=lambda f: f.name):
+                if _compression_suffix(f.name) == suffix(self.compression):
+                    target = self._run_path(f.name, self.layout)
+                    if target == f:
+                        continue
+                    # only the location changes, the stamp stays the same
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(f, target)
+                    name, stamp = self._source_name(target), self._stamp(target)
+                else:
+                    name, stamp = self._write_run(self._read_run(f))
+                n += 1
+                # content is unchanged, the column store can keep its rows
+                entry = sources.pop(self._source_name(f), None)
+                if entry is not None:
+                    sources[name] = stamp + [entry[-1]]
+            if n > 0 and self.columns.exists():
+                self.columns.update([], sources=sources)
+
+            for branch in self.get_branches():
+                target, *others = self._branch_file_variants(branch)
+                for other in others:
+                    if other.exists():
+                        target.parent.mkdir(exist_ok=True)
+                        os.replace(other, target)
+
+            if self.layout == StorageLayout.Flat:
+                self._remove_empty_dirs()
+        return n
+
+    def _remove_empty_dirs(self) -> None:
+        for d in [self._branches_dir, self._runs_dir]:
+            if not d.is_dir():
                 continue
-            with f.open("r") as fh:
-                yield Run(**json.load(fh))
+            for sub in d.iterdir():
+                if sub.is_dir() and not any(sub.iterdir()):
+                    sub.rmdir()
+            if not any(d.iterdir()):
+                d.rmdir()
+
+    @staticmethod
+    def _stamp(path: Path) -> List[Any]:
+        st = path.stat()
+        return [st.st_mtime_ns, st.st_size]
+
+    def _sources(self) -> Dict[str, List[Any]]:
+        """
+        All stored run payloads: source name to a stamp that changes whenever
+        the payload is rewritten.
+        """
+        return {self._source_name(f): self._stamp(f) for f in self._run_files()}
+
+    def _load_source(self, name: str) -> Run:
+        return self._read_run(self.base_dir / name)
 
-    def _get_branch_file(self, branch: str) -> Path:
-        return self.base_dir / f"branch_{branch}.json"
+    def _load_sources(self, sources: Dict[str, List[Any]]) -> List[Tuple[str, Run]]:
+        """
+        Load the runs of ``sources``, source name to stamp as returned by
+        :meth:`_sources`. Returns the source names and runs in the order
+        they were read.
+        """
+        return [(name, self._load_source(name)) for name in sources]
+
+    @contextlib.contextmanager
+    def synced(self) -> Iterator["Storage"]:
+        """
+        Scan the stored runs at most once within the block. The first read
+        brings the column store up to date, later reads use it as it is, so
+        operations reading the store repeatedly do not stat every run file
+        each time. Writes of this storage object keep the store up to date,
+        runs stored by other processes meanwhile are not seen.
+        """
+        self._sync_depth += 1
+        try:
+            yield self
+        finally:
+            self._sync_depth -= 1
+            if self._sync_depth == 0:
+                self._synced = False
+
+    def _sync_columns(
+        self,
+        jobs: int = 1,
+        progress_callback: Optional[Callable[[], None]] = None,
+    ) -> ColumnStore:
+        """
+        Bring the column store up to date with the stored runs. Only sources
+        that are new or changed since the last sync are parsed, so stores
+        written before the column store existed are picked up as well. With
+        ``jobs > 1``, parsing is spread over a process pool.
+        ``progress_callback`` is called once per stored run.
+        Runs are parsed without holding the lock, so writers are not held up
+        by a long sync. The lock is only taken to update the store.
+        """
+        if self._synced:
+            if progress_callback is not None:
+                for _ in range(self.columns.num_rows()):
+                    progress_callback()
+            return self.columns
+        try:
+            columns = self._sync_columns_unlocked(jobs, progress_callback)
+        except FileNotFoundError:
+            # a source went away while it was parsed, e.g. by compaction
+            with self._lock:
+                columns = self._sync_columns_unlocked(1, None)
+        self._synced = self._sync_depth > 0
+        return columns
+
+    def _sync_columns_unlocked(
+        self,
+        jobs: int,
+        progress_callback: Optional[Callable[[], None]],
+    ) -> ColumnStore:
+        with timed("scan sources"):
+            # the manifest and the meta file are replaced atomically
+            sources = self.columns.sources()
+            exists = self.columns.exists()
+            current = self._sources()
+
+        changed = [n for n, st in current.items() if sources.get(n, [])[:-1] != st]
+        removed = [n for n in sources if n not in current]
+
+        def advance(n: int) -> None:
+            if progress_callback is not None:
+                for _ in range(n):
+                    progress_callback()
+
+        advance(len(current) - len(changed))
+        if exists and not changed and not removed:
+            return self.columns
+
+        size = min(500, max(1, math.ceil(len(changed) / (jobs * 4))))
+        chunks = [
+            {name: current[name] for name in changed[i : i + size]}
+            for i in range(0, len(changed), size)
+        ]
+
+        batches = []
+        if jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as ex:
+                futures = [submit_timed(ex, _load_batch, self, c) for c in chunks]
+                results = {}
+                for f in as_completed(futures):
+                    results[f] = timed_result(f)
+                    advance(len(results[f][0]))
+                # keep the order of the sources
+                batches = [results[f] for f in futures]
+        else:
+            for chunk in chunks:
+                batches.append(_load_batch(self, chunk))
+                advance(len(chunk))
+
+        with timed("update columns"), self._lock:
+            # sources written or synced by others since the scan are newer
+            # than what was parsed here
+            latest = self.columns.sources() if self.columns.exists() else {}
+            unchanged = {
+                n for n in changed + removed if latest.get(n) == sources.get(n)
+            }
+            sources = latest
+
+            remove = [sources.pop(n)[-1] for n in removed if n in unchanged]
+            keep = []
+            for names, batch in batches:
+                rows = [i for i, n in enumerate(names) if n in unchanged]
+                for i in rows:
+                    sources[names[i]] = current[names[i]] + [
+                        str(batch.columns["commit"][i])
+                    ]
+                keep.append(batch.take(numpy.array(rows, dtype=int)))
+            # a commit can move to another source, e.g. when it is recompressed
+            live = {entry[-1] for entry in sources.values()}
+            remove = [commit for commit in remove if commit not in live]
+
+            self.columns.update_batches(keep, remove=remove, sources=sources)
+        return self.columns
+
+    @staticmethod
+    def _read_run(file: Path) -> Run:
+        with file.open("rb") as fh:
+            return load_run(decompress(fh.read()))
+
+    def get(self, commit: Commit) -> Run:
+        for file in self._run_file_variants(commit):
+            if file.exists():
+                return self._read_run(file)
+        raise AssertionError(f"No run for commit {commit.hash}")
+
+    def _scan_run_files(self, directory: Path) -> Iterator[Path]:
+        # scandir, so telling files from directories needs no stat call
+        with os.scandir(directory) as it:
+            for entry in it:
+                name = entry.name
+                if name.startswith((".", "branch_")) or name in self._reserved_files:
+                    continue
+                if entry.is_file():
+                    yield Path(entry.path)
+
+    def _run_files(self) -> Iterator[Path]:
+        yield from self._scan_run_files(self.base_dir)
+        if self._runs_dir.is_dir():
+            with os.scandir(self._runs_dir) as it:
+                shards = [Path(e.path) for e in it if e.is_dir()]
+            for shard in shards:
+                yield from self._scan_run_files(shard)
+
+    def iterate_all(self) -> Iterator[Run]:
+        for f in sorted(self._run_files(), key=lambda f: f.name):
+            yield self._read_run(f)
+
+    def iterate_columns(
+        self, metrics: List[str], chunk_size: int
+    ) -> Iterator[Dict[str, numpy.ndarray]]:
+        """
+        The key columns and ``metrics`` of all stored runs, at most
+        ``chunk_size`` runs at a time. Rows come from the column store, only
+        the rows of the current chunk are held in memory.
+        """
+        columns = self._sync_columns()
+        with self._lock:
+            return columns.iterate_rows(metrics, chunk_size)
+
+    def _branch_file_variants(self, branch: str) -> List[Path]:
+        """
+        Possible tip files of ``branch``, the configured layout first
+        """
+        return [
+            (
+                self._branches_dir / f"{branch}.json"
+                if layout == StorageLayout.Sharded
+                else self.base_dir / f"branch_{branch}.json"
+            )
+            for layout in self._layouts()
+        ]
 
     def get_branch_tip(self, branch: str) -> Optional[Commit]:
-        filename = self._get_branch_file(branch)
-        if not filename.exists():
-            return None
-        with filename.open("r") as fh:
-            return Commit(**json.load(fh))
+        for filename in self._branch_file_variants(branch):
+            if filename.exists():
+                with filename.open("r") as fh:
+                    return Commit(**json.load(fh))
+        return None
 
     def get_branches(self) -> List[str]:
         out = []
@@ -67,8 +466,54 @@ class Storage:
             m = re.match(r"^branch_(.*).json$", f.name)
             out.append(m.group(1))
             # out.append(f.read_text().strip())
+        if self._branches_dir.is_dir():
+            for f in self._branches_dir.iterdir():
+                if f.suffix == ".json" and f.stem not in out:
+                    out.append(f.stem)
         return out
 
+    def gc(self, retention: Retention, now: Optional[datetime] = None) -> RetentionPlan:
+        """
+        Plan ``retention`` and apply it. The plan is made under the lock, so
+        runs stored while planning are neither dropped nor lost from the
+        parent links. Returns the plan that was applied.
+        """
+        # most of the sync happens before writers are held up
+        self._sync_columns()
+        with self._lock:
+            tips = {b: c.hash for b, c in self.find_branch_tips().items()}
+            plan = plan_retention(self.graph(), tips, retention, now)
+            if plan:
+                self.apply_retention(plan)
+        return plan
+
+    def apply_retention(self, plan: RetentionPlan) -> None:
+        """
+        Rewrite parent links, then remove the runs and branches in ``plan``.
+        The plan must describe the current runs, see :meth:`gc`.
+        """
+        with self._lock:
+            for commit, parent in plan.reparent.items():
+                run = self.get(Commit.construct(hash=commit))
+                if parent is None:
+                    run.parent = None
+                else:
+                    run.parent = self.get(Commit.construct(hash=parent)).commit
+                self._write_run(run)
+
+            for commit in plan.drop:
+                self._delete_run(commit)
+
+            for branch in plan.branches:
+                for f in self._branch_file_variants(branch):
+                    f.unlink(missing_ok=True)
+            # runs changed behind the column store's back
+            self._synced = False
+
+            # counts and first commits changed, rebuild from the column store
+            self._catalog.file.unlink(missing_ok=True)
+            self.catalog()
+
     def find_branch_tips(self) -> Dict[str, Commit]:
         return {b: self.get_branch_tip(b) for b in self.get_branches()}
 
@@ -99,87 +544,188 @@ class Storage:
 
         return tips
 
-    def iterate(self, start: Commit) -> Iterator[Run]:
-        current = self.get(start)
-        buffer = [None] * 50
-        i = 0
-        buffer[0] = current.commit.hash
-        i += 1
+    def graph(self) -> CommitGraph:
+        columns = self._sync_columns()
+        with self._lock:
+            return CommitGraph.from_columns(
+                columns.load(("commit", "parent", "branch", "date"), metrics=())
+            )
 
-        yield current
-        while current.parent is not None:
-            current = self.get(current.parent)
+    def iterate(self, start: Commit, limit: Optional[int] = None) -> Iterator[Run]:
+        """
+        Yield the run for ``start`` and its ancestors, newest first, at most
+        ``limit`` runs. The history is walked on the commit graph, runs are
+        only loaded once they are consumed.
+        """
+        graph = self.graph()
+        assert start.hash in graph, f"No run for commit {start.hash}"
+        for commit in graph.history(start.hash, limit):
+            yield self.get(Commit.construct(hash=commit))
 
-            if current.commit.hash in buffer:
-                raise RuntimeError(
-                    f"Cycle in commit sequence detected: \n{current.commit}"
+    def catalog(self) -> Dict[str, MetricInfo]:
+        """
+        Information on all stored metrics, by name
+        """
+        if not self._catalog.exists():
+            # store predates the catalog, or runs were replaced
+            self._sync_columns()
+        with self._lock:
+            if not self._catalog.exists():
+                self._catalog.write(
+                    MetricCatalog.from_columns(
+                        self.columns.load(), self.columns.metrics()
+                    )
                 )
+            return self._catalog.load()
 
-            buffer[i % len(buffer)] = current.commit.hash
-            i += 1
-            yield current
-
-    def get_metrics(self) -> List[Metric]:
-        res = {}
-        for run in self.iterate_all():
-            for m in run.results:
-                m2 = m.copy()
-                m2.value = None
-                g = m2.group if m2.group is not None else "other"
-                res.setdefault(g, set())
-                res[g].add(m2)
-        for g, metrics in res.items():
-            res[g] = sorted(metrics, key=lambda m: m.name)
+    def get_metrics(self) -> Dict[str, List[Metric]]:
+        res: Dict[str, List[Metric]] = {}
+        for info in sorted(self.catalog().values(), key=lambda m: m.name):
+            g = info.group if info.group is not None else "other"
+            res.setdefault(g, []).append(info.to_metric())
         return res
 
     def dataframe(
         self,
         with_metrics: bool = False,
         progress_callback: Optional[Callable[[], None]] = None,
+        jobs: int = 1,
+    ) -> Union[pandas.DataFrame, Tuple[pandas.DataFrame, Dict[str, List[Metric]]]]:
+        """
+        The wide frame of all branch histories. ``jobs`` processes are used
+        to parse runs that are not in the column store yet.
+        ``progress_callback`` is called once per stored run.
+        """
+        columns = self._sync_columns(jobs, progress_callback)
+        with self._lock:
+            data = columns.load()
+            metrics = columns.metrics()
+        return self._make_dataframe(data, metrics, with_metrics)
+
+    def _make_dataframe(
+        self,
+        data: Dict[str, numpy.ndarray],
+        metrics: List[Metric],
+        with_metrics: bool = False,
     ) -> Union[pandas.DataFrame, Tuple[pandas.DataFrame, Dict[str, List[Metric]]]]:
-        tips = self.find_branch_tips()
-        tip: Commit
-        # print(tips)
-
-        res = {}
-
-        def iterator() -> Iterator[Dict[str, float]]:
-            for tip in tips.values():
-                # print(tip)
-                for run in self.iterate(tip):
-                    # print(run)
-                    d = dict([(m.name, m.value) for m in run.results])
-                    d["branch"] = run.branch
-                    d["commit"] = run.commit.hash
-                    d["date"] = run.commit.date
-                    d["parent"] = run.parent.hash if run.parent is not None else None
-                    d["message"] = run.commit.message
-
-                    if with_metrics:
-                        for m in run.results:
-                            m2 = m.copy()
-                            m2.value = None
-                            g = m2.group if m2.group is not None else "other"
-                            res.setdefault(g, set())
-                            res[g].add(m2)
-
-                    if progress_callback is not None:
-                        progress_callback()
-                    print(d["message"])
-                    yield d
-
-        df = pandas.DataFrame.from_records(iterator())
+        """
+        Assemble the wide frame from columnar ``data`` (key columns and one
+        array per metric), following the branch tips through the parent column.
+        """
+        graph = CommitGraph.from_columns(data)
+        take = graph.select(tip.hash for tip in self.find_branch_tips().values())
+        df = make_frame(data, take, [m.name for m in metrics])
+
         if with_metrics:
+            res: Dict[str, List[Metric]] = {}
+            for m in metrics:
+                res.setdefault(m.group if m.group is not None else "other", []).append(
+                    m
+                )
+            for g in res:
+                res[g].sort(key=lambda m: m.name)
             return df, res
         else:
             return df
 
+    def query(
+        self,
+        metrics: Optional[Iterable[str]] = None,
+        branches: Optional[Iterable[str]] = None,
+        since: Optional[datetime] = None,
+        limit_per_branch: Optional[int] = None,
+        progress_callback: Optional[Callable[[], None]] = None,
+        jobs: int = 1,
+    ) -> pandas.DataFrame:
+        """
+        Like :meth:`dataframe`, restricted to the ``metrics`` and ``branches``
+        given (all if ``None``), to commits dated ``since`` or later, and to
+        the newest ``limit_per_branch`` commits of every branch. Branch
+        histories are walked on the commit columns, the message and metric
+        columns are only read for the selected rows.
+        """
+        if metrics is not None:
+            metrics = list(metrics)
+
+        columns = self._sync_columns(jobs, progress_callback)
+        with self._lock:
+            with timed("load columns"):
+                data = columns.load(metrics=metrics, mmap=True)
+            if metrics is None:
+                metrics = [m.name for m in columns.metrics()]
+            tips = self.find_branch_tips()
+
+        if branches is not None:
+            tips = {b: tips[b] for b in branches if b in tips}
+        with timed("select commits"):
+            graph = CommitGraph.from_columns(data)
+            take = graph.select(
+                (tip.hash for tip in tips.values()), since, limit_per_branch
+            )
+        with timed("make frame"):
+            return make_frame(data, take, metrics)
+
     def num_runs(self) -> int:
-        n = 0
-        for f in sorted(self.base_dir.iterdir()):
-            if not f.is_file():
-                continue
-            if f.name.startswith("branch_"):
-                continue
-            n += 1
-        return n
+        return sum(1 for _ in self._run_files())
+
+
+def make_frame(
+    data: Dict[str, numpy.ndarray], take: numpy.ndarray, metrics: List[str]
+) -> pandas.DataFrame:
+    """
+    The wide frame of the rows ``take`` of the key columns and ``metrics``
+    """
+    parent = data["parent"][take].astype(object)
+    parent[parent == ""] = None
+    df = pandas.DataFrame(
+        {
+            "branch": data["branch"][take],
+            "commit": data["commit"][take],
+            "date": _parse_dates(data["date"][take]),
+            "parent": parent,
+            "message": data["message"][take],
+        }
+    )
+    return pandas.concat(
+        [df]
+        + [
+            pandas.Series(numpy.asarray(data[name][take], dtype=float), name=name)
+            for name in metrics
+        ],
+        axis=1,
+    )
+
+
+def _compression_suffix(name: str) -> str:
+    for s in SUFFIXES:
+        if name.endswith(s):
+            return s
+    return ""
+
+
+def _load_batch(
+    storage: Storage, sources: Dict[str, List[Any]]
+) -> Tuple[List[str], ColumnBatch]:
+    # module level, so it can be sent to worker processes
+    with timed("read runs"):
+        loaded = storage._load_sources(sources)
+    with timed("build columns"):
+        return [name for name, _ in loaded], ColumnBatch.from_runs(
+            run for _, run in loaded
+        )
+
+
+def open_storage(spec: Spec) -> Storage:
+    if spec.storage_backend == StorageBackend.Sqlite:
+        from headwind.sqlite_storage import SqliteStorage
+
+        return SqliteStorage(spec.storage_dir)
+    if spec.storage_backend == StorageBackend.Segments:
+        from headwind.segment_storage import SegmentStorage
+
+        return SegmentStorage(spec.storage_dir, compression=spec.storage_compression)
+    return Storage(
+        spec.storage_dir,
+        compression=spec.storage_compression,
+        layout=spec.storage_layout,
+    )
@@ -0,0 +1,177 @@
+import contextlib
+import contextvars
+from concurrent.futures import Executor, Future
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+
+class Span(BaseModel):
+    name: str
+    category: str
+    # perf_counter seconds, comparable between the processes of one machine
+    start: float
+    wall: float
+    # CPU time of the thread that ran the span
+    cpu: float
+    pid: int
+    tid: int
+
+
+class Timings:
+    """
+    Spans recorded while the timings are active, see :func:`record`. Worker
+    processes record their own spans, which are added with :meth:`extend`.
+    """
+
+    spans: List[Span]
+
+    def __init__(self) -> None:
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def extend(self, spans: List[Span]) -> None:
+        with self._lock:
+            self.spans.extend(spans)
+
+    def summary(self) -> List[Tuple[str, str, int, float, float, float]]:
+        """
+        Category, name, count, total wall and CPU time, and the longest
+        wall time of the spans, by category and name, slowest first
+        """
+        totals: Dict[Tuple[str, str], List[float]] = {}
+        for span in self.spans:
+            total = totals.setdefault((span.category, span.name), [0, 0.0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += span.wall
+            total[2] += span.cpu
+            total[3] = max(total[3], span.wall)
+        rows = [
+            (category, name, int(n), wall, cpu, longest)
+            for (category, name), (n, wall, cpu, longest) in totals.items()
+        ]
+        return sorted(rows, key=lambda r: r[3], reverse=True)
+
+    def trace_events(self) -> List[Dict[str, Any]]:
+        """
+        The spans as complete events of the Chrome trace event format, which
+        chrome://tracing and Perfetto show as flame charts
+        """
+        origin = min((s.start for s in self.spans), default=0.0)
+        return [
+            {
+                "name": s.name,
+                "cat": s.category,
+                "ph": "X",
+                "ts": round((s.start - origin) * 1e6, 1),
+                "dur": round(s.wall * 1e6, 1),
+                "pid": s.pid,
+                "tid": s.tid,
+                "args": {"cpu_ms": round(s.cpu * 1e3, 3)},
+            }
+            for s in sorted(self.spans, key=lambda s: s.start)
+        ]
+
+    def write_trace(self, file: Path) -> None:
+        with file.open("w") as fh:
+            json.dump({"traceEvents": self.trace_events()}, fh)
+
+
+# spans are only recorded while this is set
+current_timings: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar(
+    "current_timings", default=None
+)
+
+
+@contextlib.contextmanager
+def record() -> Iterator[Timings]:
+    timings = Timings()
+    token = current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_timings.reset(token)
+
+
+@contextlib.contextmanager
+def timed(name: str, category: str = "phase") -> Iterator[None]:
+    """
+    Record the wall and CPU time of the block as a span, if timings are
+    being recorded
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        timings.add(
+            Span(
+                name=name,
+                category=category,
+                start=start,
+                wall=time.perf_counter() - start,
+                cpu=time.thread_time() - cpu,
+                pid=os.getpid(),
+                tid=threading.get_ident(),
+            )
+        )
+
+
+def call_recorded(
+    submitted: float, fn: Callable[..., Any], *args: Any
+) -> Tuple[Any, List[Span]]:
+    """
+    Call ``fn`` in a worker, with its own timings. Returns the result and the
+    spans, including the time between ``submitted`` and the start of the
+    call, which covers pickling the arguments and waiting for a worker.
+    """
+    with record() as timings:
+        timings.add(
+            Span(
+                name="queued",
+                category="transfer",
+                start=submitted,
+                wall=time.perf_counter() - submitted,
+                cpu=0.0,
+                pid=os.getpid(),
+                tid=threading.get_ident(),
+            )
+        )
+        result = fn(*args)
+    return result, timings.spans
+
+
+def submit_timed(ex: Executor, fn: Callable[..., Any], *args: Any) -> Future:
+    """
+    Submit ``fn`` to a process pool. While timings are recorded, the worker
+    records spans as well, get the result with :func:`timed_result`.
+    """
+    if current_timings.get() is None:
+        return ex.submit(fn, *args)
+    return ex.submit(call_recorded, time.perf_counter(), fn, *args)
+
+
+def timed_result(future: Future) -> Any:
+    """
+    The result of a future from :func:`submit_timed`, the spans of the
+    worker are added to the current timings
+    """
+    timings = current_timings.get()
+    if timings is None:
+        return future.result()
+    result, spans = future.result()
+    timings.extend(spans)
+    return result
@@ -0,0 +1,147 @@
+from datetime import datetime, timezone
+from enum import Enum
+from itertools import islice
+from pathlib import Path
+from typing import IO, Any, Iterator, List, Tuple
+
+import pandas
+
+from headwind.spec import Run
+from headwind.storage import Storage
+
+
+class ExportFormat(str, Enum):
+    Parquet = "parquet"
+    Csv = "csv"
+    Ndjson = "ndjson"
+
+    @classmethod
+    def from_path(cls, path: Path) -> "ExportFormat":
+        suffix = path.suffix.lower()
+        if suffix == ".jsonl":
+            return cls.Ndjson
+        return cls(suffix.lstrip("."))
+
+
+def _chunks(runs: Iterator[Run], size: int) -> Iterator[List[Run]]:
+    while True:
+        chunk = list(islice(runs, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _utc(date: datetime) -> datetime:
+    # naive dates are taken to be UTC
+    return date if date.tzinfo is not None else date.replace(tzinfo=timezone.utc)
+
+
+def _table_chunks(storage: Storage, chunk_size: int) -> Iterator[pandas.DataFrame]:
+    """
+    Yield the stored runs as wide frames of at most ``chunk_size`` rows. The
+    metric columns come from the catalog, so every chunk has the same columns.
+    Rows are read from the columnar data, runs are not parsed again.
+    """
+    metrics = [m.name for ms in storage.get_metrics().values() for m in ms]
+    for data in storage.iterate_columns(metrics, chunk_size):
+        parent = data["parent"].astype(object)
+        parent[parent == ""] = None
+        df = pandas.DataFrame(
+            {
+                "branch": data["branch"],
+                "commit": data["commit"],
+                "date": pandas.to_datetime(data["date"], utc=True, format="ISO8601"),
+                "parent": parent,
+                "message": data["message"],
+            }
+        )
+        yield pandas.concat(
+            [df] + [pandas.Series(data[name], name=name) for name in metrics],
+            axis=1,
+        )
+
+
+def _import_pyarrow() -> Tuple[Any, Any]:
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Exporting to Parquet requires pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def export_runs(
+    storage: Storage, output: Path, fmt: ExportFormat, chunk_size: int = 10000
+) -> int:
+    """
+    Write all stored runs to ``output``, ``chunk_size`` runs at a time.
+    NDJSON holds the complete runs, one per line, and can be read back by
+    :func:`read_runs`. Parquet and CSV hold one row per run with a column
+    per metric. Returns the number of runs written.
+    """
+    n = 0
+    if fmt == ExportFormat.Ndjson:
+        with output.open("w") as fh:
+            for chunk in _chunks(storage.iterate_all(), chunk_size):
+                fh.write("".join(run.json() + "\n" for run in chunk))
+                n += len(chunk)
+        return n
+
+    if fmt == ExportFormat.Csv:
+        with output.open("w", newline="") as fh:
+            for i, df in enumerate(_table_chunks(storage, chunk_size)):
+                df.to_csv(fh, header=i == 0, index=False)
+                n += len(df)
+        return n
+
+    pyarrow, parquet = _import_pyarrow()
+    metrics = [m.name for ms in storage.get_metrics().values() for m in ms]
+    schema = pyarrow.schema(
+        [
+            ("branch", pyarrow.string()),
+            ("commit", pyarrow.string()),
+            ("date", pyarrow.timestamp("ns", tz="UTC")),
+            ("parent", pyarrow.string()),
+            ("message", pyarrow.string()),
+        ]
+        + [(name, pyarrow.float64()) for name in metrics]
+    )
+    with parquet.ParquetWriter(output, schema) as writer:
+        for df in _table_chunks(storage, chunk_size):
+            writer.write_table(
+                pyarrow.Table.from_pandas(df, schema=schema, preserve_index=False)
+            )
+            n += len(df)
+    return n
+
+
+def read_runs(fh: IO[str]) -> Iterator[Run]:
+    """
+    Read runs from NDJSON, one run per line. Runs from outside headwind are
+    validated.
+    """
+    for line in fh:
+        if line.strip():
+            yield Run.parse_raw(line)
+
+
+def import_runs(storage: Storage, runs: Iterator[Run]) -> Tuple[int, int]:
+    """
+    Store ``runs`` in one batch. Runs are ordered by commit date, and each
+    run's parent is the previous run on its branch, parent links in the
+    input are not used. Runs for commits that are already stored are
+    skipped. Returns the number of runs imported and skipped.
+    """
+    existing = set(storage.graph().commit)
+    new = []
+    skipped = 0
+    for run in runs:
+        if run.commit.hash in existing:
+            skipped += 1
+            continue
+        existing.add(run.commit.hash)
+        new.append(run)
+
+    new.sort(key=lambda run: _utc(run.commit.date))
+    storage.store_runs(new)
+    return len(new), skipped
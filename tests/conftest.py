@@ -1,21 +1,41 @@
+from pathlib import Path
+from typing import cast
+
 import pytest
 
+from headwind.spec import StorageBackend
 from headwind.storage import Storage
+from headwind.sqlite_storage import SqliteStorage
+from headwind.segment_storage import SegmentStorage
 
 from headwind.test import generate_dummy_data
 
 
+def make_storage(backend: StorageBackend, storage_dir: Path) -> Storage:
+    if backend == StorageBackend.Sqlite:
+        return SqliteStorage(storage_dir)
+    if backend == StorageBackend.Segments:
+        # small segments, so the tests roll over
+        return SegmentStorage(storage_dir, segment_size=16 * 1024)
+    return Storage(storage_dir)
+
+
 @pytest.fixture
 def dummy_runs():
     return generate_dummy_data(42, 100, ("main", "feature"))
 
 
+@pytest.fixture(params=list(StorageBackend))
+def storage_backend(request) -> StorageBackend:
+    return cast(StorageBackend, request.param)
+
+
 @pytest.fixture
-def stored_runs(dummy_runs, tmp_path) -> Storage:
+def stored_runs(dummy_runs, storage_backend, tmp_path) -> Storage:
     storage_dir = tmp_path / "storage"
     storage_dir.mkdir()
 
-    storage = Storage(storage_dir)
+    storage = make_storage(storage_backend, storage_dir)
     for run in dummy_runs:
         storage.store_run(run)
     return storage
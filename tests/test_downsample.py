@@ -0,0 +1,29 @@
+import numpy
+
+from headwind.downsample import min_max_indices
+
+
+def test_min_max_indices() -> None:
+    rng = numpy.random.default_rng(42)
+    values = rng.uniform(size=10000)
+    values[5000] = 50
+    values[7000] = -50
+    values[100:200] = numpy.nan
+
+    idx = min_max_indices(values, 100)
+    assert len(idx) <= 100
+    assert numpy.all(numpy.diff(idx) > 0)
+    assert idx[0] == 0 and idx[-1] == len(values) - 1
+    assert 5000 in idx and 7000 in idx
+    assert not numpy.isnan(values[idx[1:-1]]).any()
+
+    # short series are left alone
+    assert list(min_max_indices(values[:50], 100)) == list(range(50))
+
+
+def test_min_max_indices_all_missing() -> None:
+    values = numpy.full(100, numpy.nan)
+    values[:10] = 1.0
+    idx = min_max_indices(values, 10)
+    assert len(idx) <= 10
+    assert 0 in idx and 99 in idx
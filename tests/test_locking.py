@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+from headwind.locking import FileLock, LockTimeout, atomic_write
+
+
+def test_lock(tmp_path: Path) -> None:
+    path = tmp_path / ".lock"
+    lock = FileLock(path, timeout=0.1)
+
+    with lock:
+        assert path.read_text() == f"{os.getpid()}\n"
+        # reentrant
+        with lock:
+            pass
+
+        other = FileLock(path, timeout=0.1)
+        with pytest.raises(LockTimeout):
+            other.acquire()
+
+    # the file stays, only the lock on it is dropped
+    assert path.exists()
+    with other:
+        pass
+
+
+def test_lock_threads(tmp_path: Path) -> None:
+    lock = FileLock(tmp_path / ".lock", timeout=0.1)
+    errors = []
+
+    def acquire() -> None:
+        try:
+            lock.acquire()
+        except LockTimeout as e:
+            errors.append(e)
+
+    with lock:
+        # other threads wait for the holding thread up to the timeout
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+    assert len(errors) == 1
+
+
+def hold_lock(path: Path) -> None:
+    FileLock(path).acquire()
+    # exit without releasing
+    os._exit(0)
+
+
+def test_lock_crashed_holder(tmp_path: Path) -> None:
+    path = tmp_path / ".lock"
+    # left over from a crash
+    path.write_text("12345\n")
+    process = multiprocessing.Process(target=hold_lock, args=(path,))
+    process.start()
+    process.join()
+
+    with FileLock(path, timeout=1):
+        assert path.read_text() == f"{os.getpid()}\n"
+
+
+def test_atomic_write(tmp_path: Path) -> None:
+    path = tmp_path / "file.json"
+    atomic_write(path, "content")
+    assert path.read_text() == "content"
+    atomic_write(path, b"bytes")
+    assert path.read_bytes() == b"bytes"
+    assert [f.name for f in tmp_path.iterdir()] == ["file.json"]
@@ -0,0 +1,76 @@
+import time
+
+import numpy
+import pandas
+
+from headwind.regression import ChangeKind, detect_changes
+from headwind.spec import Metric
+
+
+def make_frame(values: dict, branch: str = "main") -> pandas.DataFrame:
+    n = len(next(iter(values.values())))
+    # newest first, like the frames from storage
+    return pandas.DataFrame(
+        {
+            "branch": [branch] * n,
+            "commit": [f"{i:040d}" for i in range(n)][::-1],
+            "message": [f"commit {i}" for i in range(n)][::-1],
+            **{name: numpy.asarray(v, dtype=float)[::-1] for name, v in values.items()},
+        }
+    )
+
+
+def metric(name: str) -> Metric:
+    return Metric(name=name, group="group", value=None, unit="s")
+
+
+def test_detect_changes() -> None:
+    rng = numpy.random.default_rng(42)
+    n = 60
+    noise = rng.normal(0, 0.1, size=n)
+    df = make_frame(
+        {
+            # slower from commit 30 on
+            "slow": 10 + noise + numpy.where(numpy.arange(n) >= 30, 2.0, 0.0),
+            # faster from commit 20 on, without any noise
+            "fast": numpy.where(numpy.arange(n) >= 20, 5.0, 8.0),
+            "flat": 10 + rng.normal(0, 0.1, size=n),
+            "missing": numpy.full(n, numpy.nan),
+        }
+    )
+    metrics = [metric(name) for name in ["slow", "fast", "flat", "missing"]]
+
+    changes = detect_changes(df, metrics)
+    assert [(c.metric, c.kind) for c in changes] == [
+        ("fast", ChangeKind.Improvement),
+        ("slow", ChangeKind.Regression),
+    ]
+    fast, slow = changes
+    assert fast.commit == f"{20:040d}"
+    assert fast.parent == f"{19:040d}"
+    assert fast.message == "commit 20"
+    assert fast.before == 8.0
+    assert fast.after == 5.0
+    assert fast.change == -0.375
+    assert slow.commit == f"{30:040d}"
+    assert slow.change > 0.15
+    assert slow.to_metric().group == "group"
+
+    # branches are looked at separately
+    df2 = pandas.concat([df, make_frame({"slow": numpy.full(n, 10.0)}, "feature")])
+    changes = detect_changes(df2, metrics[:1])
+    assert [c.branch for c in changes] == ["main"]
+
+
+def test_detect_changes_many_metrics() -> None:
+    rng = numpy.random.default_rng(0)
+    n, m = 2000, 300
+    values = rng.normal(10, 0.5, size=(n, m))
+    values[1000:, 0] += 5
+    df = make_frame({f"metric.{j}": values[:, j] for j in range(m)})
+
+    start = time.perf_counter()
+    changes = detect_changes(df, [metric(f"metric.{j}") for j in range(m)])
+    assert time.perf_counter() - start < 10
+
+    assert [(c.metric, c.commit) for c in changes] == [("metric.0", f"{1000:040d}")]
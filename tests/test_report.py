@@ -0,0 +1,326 @@
+import json
+import re
+from pathlib import Path
+from typing import Dict
+
+import numpy
+import pandas
+import pytest
+
+from headwind.report import (
+    CHANGES_FILE,
+    MANIFEST_FILE,
+    RenderMode,
+    chart_json,
+    chart_name,
+    copy_static,
+    github_project,
+    group_summary,
+    make_report,
+    read_manifest,
+    static_assets,
+    table_frame,
+)
+from headwind.spec import Metric, ReportFilter, Spec
+from headwind.storage import Storage
+from headwind.test import generate_dummy_data
+
+
+@pytest.fixture
+def spec(tmp_path: Path) -> Spec:
+    spec_file = tmp_path / "spec.yml"
+    spec_file.write_text("")
+    return Spec(
+        collectors=[{"type": "command", "arg": "true"}],
+        spec_file=spec_file,
+        storage_dir="storage",
+        report_num_commits=20,
+    )
+
+
+def page_mtimes(output: Path) -> Dict[str, int]:
+    return {page: (output / page).stat().st_mtime_ns for page in read_manifest(output)}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_incremental_report(spec: Spec, tmp_path: Path, jobs: int) -> None:
+    storage = Storage(spec.storage_dir)
+    runs = generate_dummy_data(42, 30, ["main", "feature"])
+    for run in runs[:-1]:
+        storage.store_run(run)
+
+    output = tmp_path / "output"
+    output.mkdir()
+    make_report(spec, storage, output, jobs=jobs)
+
+    assert (output / MANIFEST_FILE).exists()
+    first = page_mtimes(output)
+    # start page, three group pages, five metric pages
+    assert len(first) == 9
+    assert "metric/group_a/metric.a.uniform/index.html" in first
+
+    page_dir = output / "metric" / "group_a" / "metric.a.uniform"
+    assert sorted(f.name for f in page_dir.iterdir()) == sorted(
+        [f"{chart_name('feature')}.json", f"{chart_name('main')}.json", "index.html"]
+    )
+    points = json.loads((page_dir / f"{chart_name('main')}.json").read_text())
+    # by default, charts show the newest 20 commits like the table
+    assert len(points) == 20
+    assert {p["commit"] for p in points} <= {r.commit.hash for r in runs[:30]}
+
+    # nothing changed, nothing is rendered
+    make_report(spec, storage, output, jobs=jobs)
+    assert page_mtimes(output) == first
+
+    # a new commit changes every metric and group page, not the start page
+    storage.store_run(runs[-1])
+    make_report(spec, storage, output, jobs=jobs)
+    second = page_mtimes(output)
+    changed = {p for p in first if first[p] != second[p]}
+    assert changed == set(first) - {"index.html"}
+
+    # pages from earlier publishes that no longer exist are removed
+    stale = output / "metric" / "group_x" / "metric.x" / "index.html"
+    stale.parent.mkdir(parents=True)
+    stale.write_text("")
+    manifest = read_manifest(output)
+    manifest["metric/group_x/metric.x/index.html"] = "abc"
+    (output / MANIFEST_FILE).write_text(json.dumps(manifest))
+
+    make_report(spec, storage, output, jobs=jobs, force=True)
+    assert not (output / "metric" / "group_x").exists()
+    assert all(second[p] != t for p, t in page_mtimes(output).items())
+
+
+def test_render_modes(spec: Spec, tmp_path: Path) -> None:
+    storage = Storage(spec.storage_dir)
+    for run in generate_dummy_data(42, 30, ["main", "feature"]):
+        storage.store_run(run)
+
+    pages = []
+    for jobs, mode in [
+        (1, RenderMode.Processes),
+        (4, RenderMode.Processes),
+        (4, RenderMode.Threads),
+    ]:
+        output = tmp_path / f"output_{jobs}_{mode.value}"
+        output.mkdir()
+        make_report(spec, storage, output, jobs=jobs, render_mode=mode)
+        pages.append({p: (output / p).read_text() for p in read_manifest(output)})
+
+    assert pages[0] == pages[1] == pages[2]
+    # relative links depend on the page each thread renders
+    page = pages[2]["metric/group_a/metric.a.uniform/index.html"]
+    assert 'href="../../../static/' in page
+    assert static_assets()["css/bulma/bulma.min.css"] in page
+
+
+def test_chart_json_and_table() -> None:
+    tpl_df = pandas.DataFrame(
+        {
+            "branch": ["main"] * 3,
+            "commit": ["a" * 40, "b" * 40, "c" * 40],
+            "date": pandas.to_datetime(
+                ["2021-05-03 10:00", "2021-05-02 11:30", "2021-05-01 12:00"]
+            ),
+            "message": ["Fix #12\n\ndetails", "</script> & more", "older"],
+            "value": [1.5, numpy.nan, 3.0],
+        }
+    )
+
+    chart = chart_json(tpl_df, 2)
+    assert json.loads(chart) == [
+        {
+            "x": "aaaaaaa 2021-05-03",
+            "y": 1.5,
+            "commit": "a" * 40,
+            "message": "Fix #12\n\ndetails",
+        },
+        {
+            "x": "bbbbbbb 2021-05-02",
+            "y": None,
+            "commit": "b" * 40,
+            "message": "</script> & more",
+        },
+    ]
+
+    # small values keep their significant digits
+    tiny = tpl_df.assign(value=[1.23456789e-10, 1.23456789e-18, numpy.inf])
+    assert [p["y"] for p in json.loads(chart_json(tiny, None))] == [
+        1.23456789e-10,
+        1.23456789e-18,
+        None,
+    ]
+
+    token = github_project.set("org/repo")
+    try:
+        table = table_frame(tpl_df)
+    finally:
+        github_project.reset(token)
+    assert list(table.date) == [
+        "2021-05-03 10:00",
+        "2021-05-02 11:30",
+        "2021-05-01 12:00",
+    ]
+    assert table.message[0] == (
+        'Fix <a target="blank" href="https://github.com/org/repo/issues/12">#12</a>'
+    )
+    assert list(table.value) == ["1.50", "nan", "3.00"]
+
+
+def test_chart_names(spec: Spec, tmp_path: Path) -> None:
+    # branches that sanitize to the same path still get their own chart
+    assert chart_name("a/b") != chart_name("a_b")
+
+    storage = Storage(spec.storage_dir)
+    branches = ["main", "fix#12%"]
+    for run in generate_dummy_data(42, 10, branches):
+        storage.store_run(run)
+
+    output = tmp_path / "output"
+    output.mkdir()
+    make_report(spec, storage, output)
+
+    page_dir = output / "metric" / "group_a" / "metric.a.uniform"
+    html = (page_dir / "index.html").read_text()
+    for branch in branches:
+        points = json.loads((page_dir / f"{chart_name(branch)}.json").read_text())
+        assert len(points) == 10
+        assert f'data-src="{chart_name(branch)}.json"' in html
+
+
+def test_downsampled_charts(spec: Spec, tmp_path: Path) -> None:
+    spec.report_chart_points = 10
+    spec.report_chart_commits = 25
+    storage = Storage(spec.storage_dir)
+    runs = generate_dummy_data(42, 30, ["main"])
+    runs[-5].results[0].value = 1000.0
+    for run in runs:
+        storage.store_run(run)
+
+    output = tmp_path / "output"
+    output.mkdir()
+    make_report(spec, storage, output)
+
+    page_dir = output / "metric" / "group_a" / "metric.a.uniform"
+    main = chart_name("main")
+    points = json.loads((page_dir / f"{main}.json").read_text())
+    full = json.loads((page_dir / f"{main}.full.json").read_text())
+    assert len(points) <= 10
+    # charts reach further back than the table
+    assert len(full) == 25
+    # newest and oldest point, and the spike, survive downsampling
+    assert points[0] == full[0]
+    assert points[-1] == full[-1]
+    assert max(p["y"] for p in points) == 1000.0
+    html = (page_dir / "index.html").read_text()
+    assert f"{main}.full.json" in html
+    assert runs[-20].commit.hash in html
+    assert runs[-21].commit.hash not in html
+
+    # without downsampling, there is no separate full resolution series
+    spec.report_chart_points = None
+    make_report(spec, storage, output)
+    assert not (page_dir / f"{main}.full.json").exists()
+    assert len(json.loads((page_dir / f"{main}.json").read_text())) == 25
+
+    # shorter chart windows are cut from the table's commits
+    spec.report_chart_commits = 5
+    make_report(spec, storage, output)
+    assert len(json.loads((page_dir / f"{main}.json").read_text())) == 5
+    assert runs[-20].commit.hash in (page_dir / "index.html").read_text()
+
+
+def test_changes_on_index(spec: Spec, tmp_path: Path) -> None:
+    spec.report_chart_commits = 50
+    storage = Storage(spec.storage_dir)
+    runs = generate_dummy_data(42, 60, ["main"])
+    # older than the newest 20 commits in the tables
+    for run in runs[20:]:
+        run.results[0].value = (run.results[0].value or 0.0) + 100
+    for run in runs:
+        storage.store_run(run)
+
+    output = tmp_path / "output"
+    output.mkdir()
+    make_report(spec, storage, output)
+
+    changes = json.loads((output / CHANGES_FILE).read_text())
+    assert changes[0]["kind"] == "regression"
+    assert changes[0]["metric"] == "metric.a.uniform"
+    assert changes[0]["commit"] == runs[20].commit.hash
+    index = (output / "index.html").read_text()
+    assert runs[20].commit.hash[:7] in index
+    assert 'href="metric/group_a/metric.a.uniform"' in index
+    assert "the newest 50 commits of every branch" in index
+
+
+def test_group_summary() -> None:
+    df = pandas.DataFrame(
+        {
+            "branch": ["main"] * 4 + ["feature"],
+            # newest first
+            "a": [4.0, 2.0, 1.0, 2.0, 1.0],
+            "b": [3.0, 3.0, numpy.nan, 3.0, numpy.nan],
+        }
+    )
+    metrics = [
+        Metric(name="a", group="g", value=None, unit="s"),
+        Metric(name="b", group="g", value=None, unit="MB"),
+    ]
+
+    summary = group_summary(df, metrics, num_points=3, compare=2)
+    assert list(summary.branch) == ["main", "main", "feature", "feature"]
+    assert list(summary.metric) == ["a", "b", "a", "b"]
+    assert list(summary.unit) == ["s", "MB", "s", "MB"]
+    main_a, main_b, feature_a, feature_b = summary.itertuples()
+    assert (main_a.value, main_a.vs_parent, main_a.vs_compare) == (4.0, 1.0, 3.0)
+    # oldest of the three newest values first, the largest at the top
+    assert main_a.sparkline == "0.0,20.0 50.0,13.3 100.0,0.0"
+    # flat series sit in the middle, missing values are left out
+    assert main_b.sparkline == "50.0,10.0 100.0,10.0"
+    assert numpy.isnan(main_b.vs_compare)
+    assert feature_a.sparkline == "0.0,10.0"
+    assert numpy.isnan(feature_a.vs_parent)
+    assert feature_b.sparkline == ""
+
+
+def test_filtered_group(spec: Spec, tmp_path: Path) -> None:
+    assert group_summary(pandas.DataFrame(), [], 3, 2).empty
+
+    spec.report_filter = ReportFilter(lambda m, df: m.group != "group_a")
+    storage = Storage(spec.storage_dir)
+    storage.store_runs(generate_dummy_data(42, 10, ["main"]))
+
+    output = tmp_path / "output"
+    output.mkdir()
+    make_report(spec, storage, output, jobs=2)
+
+    # the group stays in the navigation, its page has no metrics
+    html = (output / "metric" / "group_a" / "index.html").read_text()
+    assert "metric.a.uniform" not in html
+    assert not (output / "metric" / "group_a" / "metric.a.uniform").exists()
+
+
+def test_copy_static(tmp_path: Path) -> None:
+    assets = static_assets()
+    assert list(assets) == ["chart.min.js", "css/bulma/bulma.min.css"]
+    assert re.fullmatch(r"chart\.min\.[0-9a-f]{12}\.js", assets["chart.min.js"])
+
+    # left over from publishes with other assets
+    stale = tmp_path / "static" / "css" / "bulma" / "bulma.css"
+    stale.parent.mkdir(parents=True)
+    stale.write_text("")
+    (tmp_path / "static" / "chart.js").write_text("")
+
+    assert copy_static(tmp_path) == 2
+    files = sorted(
+        f.relative_to(tmp_path / "static").as_posix()
+        for f in (tmp_path / "static").rglob("*")
+        if f.is_file()
+    )
+    assert files == sorted(assets.values())
+
+    mtimes = [(tmp_path / "static" / f).stat().st_mtime_ns for f in files]
+    assert copy_static(tmp_path) == 0
+    assert [(tmp_path / "static" / f).stat().st_mtime_ns for f in files] == mtimes
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List
+
+from headwind.retention import plan_retention
+from headwind.spec import Retention, Run, StorageBackend
+from headwind.test import generate_dummy_data
+
+from conftest import make_storage
+
+now = datetime(2021, 6, 1, 12, 0)
+
+
+def make_runs() -> List[Run]:
+    # every 6 hours for 60 days on main, 10 days of an old feature branch
+    main = generate_dummy_data(1, 240, ["main"])
+    for i, run in enumerate(main):
+        run.commit.date = now - timedelta(hours=6 * (len(main) - 1 - i))
+    feature = generate_dummy_data(2, 40, ["feature"])
+    for i, run in enumerate(feature):
+        run.commit.date = now - timedelta(days=50, hours=6 * (len(feature) - 1 - i))
+    return main + feature
+
+
+retention = Retention(
+    rules=[
+        {"older_than": 30, "keep": "weekly"},
+        {"older_than": 10, "keep": "daily"},
+    ],
+    prune_branches_after=20,
+)
+
+
+def test_plan_retention(tmp_path: Path) -> None:
+    runs = make_runs()
+    storage = make_storage(StorageBackend.Files, tmp_path)
+    for run in runs:
+        storage.store_run(run)
+
+    tips = {b: c.hash for b, c in storage.find_branch_tips().items()}
+    plan = plan_retention(storage.graph(), tips, retention, now=now)
+
+    assert plan.branches == ["feature"]
+    dropped = set(plan.drop)
+    assert all(r.commit.hash in dropped for r in runs if r.branch == "feature")
+
+    kept = [r for r in runs if r.branch == "main" and r.commit.hash not in dropped]
+    ages = [(now - r.commit.date) / timedelta(days=1) for r in kept]
+    # everything within 10 days is kept
+    assert sum(1 for a in ages if a < 10) == 40
+    # one per day between 10 and 30 days
+    daily = [r.commit.date.date() for r, a in zip(kept, ages) if 10 <= a < 30]
+    assert len(daily) == len(set(daily))
+    assert 19 <= len(daily) <= 21
+    # one per week beyond
+    assert 4 <= sum(1 for a in ages if a >= 30) <= 6
+
+    # the tip is never dropped
+    assert runs[239].commit.hash not in dropped
+    # only kept runs are relinked
+    assert not dropped & set(plan.reparent)
+
+
+def test_apply_retention(storage_backend: StorageBackend, tmp_path: Path) -> None:
+    runs = make_runs()
+    storage = make_storage(storage_backend, tmp_path)
+    for run in runs:
+        storage.store_run(run)
+
+    tips = {b: c.hash for b, c in storage.find_branch_tips().items()}
+    plan = plan_retention(storage.graph(), tips, retention, now=now)
+    storage.apply_retention(plan)
+
+    assert storage.get_branches() == ["main"]
+    assert storage.num_runs() == len(runs) - len(plan.drop)
+
+    history = list(storage.iterate(storage.get_branch_tip("main")))
+    assert len(history) == storage.num_runs()
+    for run, parent in zip(history, history[1:]):
+        assert run.parent == parent.commit
+    assert history[-1].parent is None
+
+    df = storage.dataframe()
+    assert len(df) == storage.num_runs()
+    assert all(m.num_runs == storage.num_runs() for m in storage.catalog().values())
+
+    # applying again is a no-op
+    tips = {b: c.hash for b, c in storage.find_branch_tips().items()}
+    assert not plan_retention(storage.graph(), tips, retention, now=now)
+
+
+def test_gc(storage_backend: StorageBackend, tmp_path: Path) -> None:
+    runs = make_runs()
+    storage = make_storage(storage_backend, tmp_path)
+    storage.store_runs(runs)
+
+    tips = {b: c.hash for b, c in storage.find_branch_tips().items()}
+    stale = plan_retention(storage.graph(), tips, retention, now=now)
+    assert stale.branches == ["feature"]
+
+    # a run stored after planning revives the feature branch
+    (new,) = generate_dummy_data(3, 1, ["feature"])
+    new.commit.date = now
+    storage.store_run(new)
+
+    plan = storage.gc(retention, now=now)
+    assert plan.branches == []
+    assert storage.get_branch_tip("feature") == new.commit
+    # the old feature runs are thinned instead
+    assert new.commit.hash not in plan.drop
+    assert len(plan.drop) < len(stale.drop)
+    history = list(storage.iterate(new.commit))
+    assert [r.commit for r in history[:2]] == [new.commit, runs[-1].commit]
+    assert storage.num_runs() == len(runs) + 1 - len(plan.drop)
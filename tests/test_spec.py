@@ -1,4 +1,5 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import json
 from pathlib import Path
 from unittest.mock import mock_open
 
@@ -14,6 +15,7 @@ from headwind.spec import (
     Metric,
     Run,
     Commit,
+    StorageBackend,
 )
 
 
@@ -72,6 +74,21 @@ storage_dir: path
 
     assert s.collectors[0].type == CollectorType.Python
     assert s.collectors[0].arg == "some.module"
+    assert s.storage_backend == StorageBackend.Files
+
+    sin = """
+collectors:
+    - type: python
+      arg: some.module
+storage_dir: path
+storage_backend: sqlite
+"""
+
+    with mock_open(read_data=sin.strip())() as buf:
+        buf.name = tmp_path / "spec.yml"
+        s = load_spec(buf)
+
+    assert s.storage_backend == StorageBackend.Sqlite
 
     sin = """
 beep: "nope"
@@ -123,3 +140,30 @@ def test_run() -> None:
                 Metric(name="a.metric", value=42, unit="X"),
             ],
         )
+
+
+def test_run_from_trusted() -> None:
+    tz = timezone(timedelta(hours=2))
+    run = Run(
+        commit=Commit(hash="X" * 40, date=datetime.now(tz), message="blubb"),
+        parent=Commit(hash="Y" * 40, date=datetime.now(), message="blubb"),
+        branch="main",
+        date=datetime.now(),
+        results=[
+            Metric(name="a.metric", value=42, unit="X"),
+            Metric(name="b.metric", group="grp", value=None, unit="X"),
+        ],
+        context={"key": [1, 2]},
+    )
+
+    act = Run.from_trusted(json.loads(run.json()))
+    assert act == run
+    assert act.commit.date.tzinfo is not None
+    assert isinstance(act.results[0].value, float)
+
+    raw = json.loads(run.json())
+    raw["parent"] = None
+    raw["date"] = "2021-05-01T12:00:00Z"
+    act = Run.from_trusted(raw)
+    assert act.parent is None
+    assert act.date == datetime(2021, 5, 1, 12, tzinfo=timezone.utc)
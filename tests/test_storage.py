@@ -1,10 +1,27 @@
 from datetime import datetime
+import multiprocessing
 from pathlib import Path
-from typing import List
+import shutil
+import threading
+from typing import Any, Dict, List
 
+import pandas
 import pytest
-from headwind.spec import Run, Commit, Metric
+from headwind.columns import ColumnStore
+from headwind.compression import suffix
+from headwind.spec import (
+    Compression,
+    Run,
+    Commit,
+    Metric,
+    StorageBackend,
+    StorageLayout,
+)
 from headwind.storage import Storage
+from headwind.segment_storage import SegmentStorage
+from headwind.test import generate_dummy_data
+
+from conftest import make_storage
 
 
 def test_make_filename() -> None:
@@ -45,6 +62,106 @@ def test_storage(dummy_run: Run, tmp_path: Path) -> None:
         storage.get(Commit(hash="J" * 40, date=datetime.now(), message="blubb"))
 
 
+@pytest.mark.parametrize("compression", list(Compression))
+def test_compression(
+    dummy_runs: List[Run], tmp_path: Path, compression: Compression
+) -> None:
+    storage = Storage(tmp_path, compression=compression)
+    for run in dummy_runs[:10]:
+        storage.store_run(run)
+
+    run = dummy_runs[0]
+    file = tmp_path / (Storage._make_filename(run.commit) + suffix(compression))
+    assert file.exists()
+    assert storage.get(run.commit) == run
+    assert list(storage.iterate_all()) == sorted(
+        dummy_runs[:10], key=lambda r: r.commit.hash
+    )
+
+    # stores with mixed encodings are read transparently
+    plain = Storage(tmp_path)
+    for run in dummy_runs[10:20]:
+        plain.store_run(run)
+    assert storage.num_runs() == 20
+    exp = storage.dataframe()
+
+    assert storage.migrate() == (10 if compression != Compression.Off else 0)
+    assert plain.migrate() == (20 if compression != Compression.Off else 0)
+    assert storage.num_runs() == 20
+    assert all(f.name.endswith(".json") for f in plain._run_files())
+    assert storage.get(dummy_runs[0].commit) == dummy_runs[0]
+    pandas.testing.assert_frame_equal(exp, plain.dataframe())
+
+
+def test_sharded_layout(
+    dummy_runs: List[Run], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    plain = Storage(tmp_path)
+    for run in dummy_runs[:10]:
+        plain.store_run(run)
+    exp = plain.dataframe()
+
+    storage = Storage(tmp_path, layout=StorageLayout.Sharded)
+    # an unmigrated store can still be read
+    assert storage.get(dummy_runs[0].commit) == dummy_runs[0]
+    assert storage.find_branch_tips() == plain.find_branch_tips()
+
+    read = []
+    monkeypatch.setattr(Storage, "_read_run", staticmethod(lambda f: read.append(f)))
+    assert storage.migrate() == 10
+    assert read == []
+    monkeypatch.undo()
+
+    assert [f.name for f in tmp_path.iterdir() if f.suffix == ".json"] == [
+        "catalog.json"
+    ]
+    filename = Storage._make_filename(dummy_runs[0].commit)
+    assert (tmp_path / "runs" / filename[:2] / filename).exists()
+    assert sorted(f.name for f in (tmp_path / "branches").iterdir()) == sorted(
+        f"{b}.json" for b in plain.get_branches()
+    )
+    pandas.testing.assert_frame_equal(exp, storage.dataframe())
+
+    for run in dummy_runs[10:]:
+        storage.store_run(run)
+    assert storage.num_runs() == len(dummy_runs)
+    assert list(storage.iterate_all()) == sorted(
+        dummy_runs, key=lambda r: r.commit.hash
+    )
+    assert storage.find_branch_tips() == storage.find_branch_tips_slow()
+    exp = storage.dataframe()
+
+    # and back, combined with a change of compression
+    flat = Storage(tmp_path, compression=Compression.Gzip)
+    assert flat.migrate() == len(dummy_runs)
+    assert not (tmp_path / "runs").exists()
+    assert not (tmp_path / "branches").exists()
+    assert flat.num_runs() == len(dummy_runs)
+    pandas.testing.assert_frame_equal(exp, flat.dataframe())
+
+
+def test_compression_segments(dummy_runs: List[Run], tmp_path: Path) -> None:
+    plain = SegmentStorage(tmp_path)
+    for run in dummy_runs[:10]:
+        plain.store_run(run)
+    size = sum(f.stat().st_size for f in plain.segment_dir.iterdir())
+
+    storage = SegmentStorage(tmp_path, compression=Compression.Gzip)
+    assert storage.migrate() == 10
+    assert sum(f.stat().st_size for f in storage.segment_dir.iterdir()) < size
+    for run in dummy_runs[10:]:
+        storage.store_run(run)
+
+    assert list(storage.iterate_all()) == sorted(
+        dummy_runs, key=lambda r: r.commit.hash
+    )
+    assert storage.get(dummy_runs[0].commit) == dummy_runs[0]
+    (tmp_path / "reference").mkdir()
+    reference = Storage(tmp_path / "reference")
+    _store_runs(reference, dummy_runs)
+    pandas.testing.assert_frame_equal(storage.dataframe(), reference.dataframe())
+
+
 def test_iterate(dummy_runs: List[Run], stored_runs: Storage):
     mid = int(len(dummy_runs) / 2)
     act = list(stored_runs.iterate(dummy_runs[mid - 1].commit))
@@ -56,6 +173,49 @@ def test_iterate(dummy_runs: List[Run], stored_runs: Storage):
     assert exp == act
 
 
+def test_iterate_limit(dummy_runs: List[Run], stored_runs: Storage):
+    act = list(stored_runs.iterate(dummy_runs[-1].commit, limit=10))
+    exp = list(reversed(dummy_runs[-10:]))
+    assert exp == act
+
+    assert list(stored_runs.iterate(dummy_runs[-1].commit, limit=0)) == []
+
+
+def test_iterate_long_history(storage_backend: StorageBackend, tmp_path: Path):
+    storage = make_storage(storage_backend, tmp_path)
+    runs = generate_dummy_data(42, 2500, ["main"])
+    storage.store_runs(runs)
+
+    act = list(storage.iterate(runs[-1].commit))
+    assert [r.commit.hash for r in reversed(runs)] == [r.commit.hash for r in act]
+    assert act[-1] == runs[0]
+
+
+def test_graph(dummy_runs: List[Run], tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    storage = Storage(tmp_path)
+    for run in dummy_runs:
+        storage.store_run(run)
+    storage.graph()
+
+    # the graph needs the key columns only
+    def fail(*args: Any) -> None:
+        raise AssertionError("metric values were loaded")
+
+    monkeypatch.setattr(ColumnStore, "_load_values", fail)
+    graph = storage.graph()
+    monkeypatch.undo()
+    assert len(graph) == len(dummy_runs)
+    mid = int(len(dummy_runs) / 2)
+    exp = [r.commit.hash for r in reversed(dummy_runs[:mid])]
+    assert exp == list(graph.history(dummy_runs[mid - 1].commit.hash))
+
+    # the graph is enough to walk the history, the runs are loaded lazily
+    for run in dummy_runs[: mid - 5]:
+        (tmp_path / Storage._make_filename(run.commit)).unlink()
+    act = list(storage.iterate(dummy_runs[mid - 1].commit, limit=5))
+    assert list(reversed(dummy_runs[mid - 5 : mid])) == act
+
+
 def test_iterate_all(dummy_runs: List[Run], stored_runs: Storage):
     exp = sorted(dummy_runs, key=lambda r: r.commit.hash)
     act = list(stored_runs.iterate_all())
@@ -77,6 +237,32 @@ def test_dataframe(dummy_runs: List[Run], stored_runs: Storage):
     print(df.head())
     print(df.tail())
 
+    assert len(df) == len(dummy_runs)
+    by_commit = df.set_index("commit")
+    for run in dummy_runs:
+        row = by_commit.loc[run.commit.hash]
+        assert row.branch == run.branch
+        assert row.date == run.commit.date
+        assert row.message == run.commit.message
+        for m in run.results:
+            assert row[m.name] == pytest.approx(m.value)
+
+
+def test_dataframe_without_columns(dummy_runs: List[Run], tmp_path: Path):
+    stored_runs = Storage(tmp_path)
+    for run in dummy_runs:
+        stored_runs.store_run(run)
+    exp = stored_runs.dataframe()
+
+    # stores written before the column store existed get it built on demand
+    shutil.rmtree(stored_runs.columns.base_dir)
+    assert not stored_runs.columns.exists()
+
+    act, metrics = stored_runs.dataframe(with_metrics=True)
+    assert stored_runs.columns.exists()
+    pandas.testing.assert_frame_equal(exp, act)
+    assert metrics == stored_runs.get_metrics()
+
 
 def test_get_branch_tip(stored_runs: Storage, dummy_runs: List[Run]) -> None:
     mid = int(len(dummy_runs) / 2)
@@ -122,5 +308,292 @@ def test_metrics(stored_runs: Storage, dummy_runs: List[Run]) -> None:
     assert exp == act
 
 
+def test_catalog(stored_runs: Storage, dummy_runs: List[Run]) -> None:
+    catalog = stored_runs.catalog()
+    assert sorted(catalog.keys()) == sorted(m.name for m in dummy_runs[0].results)
+    for m in dummy_runs[0].results:
+        info = catalog[m.name]
+        assert info.group == m.group
+        assert info.unit == m.unit
+        assert info.first_commit == dummy_runs[0].commit.hash
+        assert info.last_commit == dummy_runs[-1].commit.hash
+        assert info.num_runs == len(dummy_runs)
+
+
+def test_catalog_rebuild(dummy_runs: List[Run], tmp_path: Path) -> None:
+    storage = Storage(tmp_path)
+    for run in dummy_runs:
+        storage.store_run(run)
+    exp = storage.catalog()
+
+    (tmp_path / "catalog.json").unlink()
+    assert storage.catalog() == exp
+    assert (tmp_path / "catalog.json").exists()
+
+
+def test_catalog_replaced_run(stored_runs: Storage, dummy_runs: List[Run]) -> None:
+    # storing a commit again replaces its run
+    run = dummy_runs[10].copy(deep=True)
+    run.branch = "other"
+    stored_runs.store_run(run)
+
+    assert stored_runs.num_runs() == len(dummy_runs)
+    for info in stored_runs.catalog().values():
+        assert info.num_runs == len(dummy_runs)
+
+
+def _store_runs(storage: Storage, runs: List[Run]) -> None:
+    for run in runs:
+        storage.store_run(run)
+
+
+def test_concurrent_store(storage_backend: StorageBackend, tmp_path: Path) -> None:
+    runs = generate_dummy_data(42, 40, ["main"])
+    storage = make_storage(storage_backend, tmp_path)
+
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=_store_runs, args=(storage, runs[i::4])) for i in range(4)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+
+    # no parent links were lost: the branch history contains every run
+    history = list(storage.iterate(storage.get_branch_tip("main")))
+    assert len(history) == len(runs)
+    assert history[-1].parent is None
+    assert storage.num_runs() == len(runs)
+    assert len(storage.dataframe()) == len(runs)
+
+
+def test_sync_does_not_block_writers(
+    dummy_runs: List[Run], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    storage = Storage(tmp_path)
+    _store_runs(storage, dummy_runs[:-1])
+    changed = dummy_runs[0].copy(deep=True)
+    changed.results[0].value = 1234.0
+    (tmp_path / Storage._make_filename(changed.commit)).write_text(
+        changed.json(indent=2)
+    )
+
+    parsing = threading.Event()
+    stored = threading.Event()
+    orig_read_run = Storage._read_run
+
+    def read_run(file: Path) -> Run:
+        parsing.set()
+        stored.wait(10)
+        return orig_read_run(file)
+
+    monkeypatch.setattr(Storage, "_read_run", staticmethod(read_run))
+    reader = threading.Thread(target=storage.dataframe)
+    reader.start()
+    assert parsing.wait(10)
+
+    # the lock is free while the reader parses the changed run
+    writer = Storage(tmp_path)
+    writer._lock.timeout = 1
+    writer.store_run(dummy_runs[-1])
+    stored.set()
+    reader.join()
+
+    df = storage.dataframe().set_index("commit")
+    assert len(df) == len(dummy_runs)
+    assert df.loc[changed.commit.hash, changed.results[0].name] == 1234.0
+
+
 def test_count(stored_runs: Storage, dummy_runs: List[Run]) -> None:
     assert stored_runs.num_runs() == len(dummy_runs)
+
+
+def test_dataframe_incremental(
+    dummy_runs: List[Run], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    storage = Storage(tmp_path)
+    for run in dummy_runs[:-1]:
+        storage.store_run(run)
+    shutil.rmtree(storage.columns.base_dir)
+
+    read = []
+    orig_read_run = Storage._read_run
+
+    def read_run(file: Path) -> Run:
+        read.append(file.name)
+        return orig_read_run(file)
+
+    monkeypatch.setattr(Storage, "_read_run", staticmethod(read_run))
+
+    # first call covers the whole history
+    storage.dataframe()
+    assert len(read) == len(dummy_runs) - 1
+
+    # runs stored through store_run do not have to be parsed again
+    read.clear()
+    storage.store_run(dummy_runs[-1])
+    df = storage.dataframe()
+    assert read == []
+    assert len(df) == len(dummy_runs)
+
+    # only changed files are parsed
+    changed = dummy_runs[-1].copy(deep=True)
+    changed.results[0].value = 1234.0
+    (tmp_path / Storage._make_filename(changed.commit)).write_text(
+        changed.json(indent=2)
+    )
+    df = storage.dataframe()
+    assert read == [Storage._make_filename(changed.commit)]
+    row = df.set_index("commit").loc[changed.commit.hash]
+    assert row[changed.results[0].name] == 1234.0
+
+    # removed files drop out of the frame
+    read.clear()
+    (tmp_path / Storage._make_filename(dummy_runs[0].commit)).unlink()
+    df = storage.dataframe()
+    assert read == []
+    assert dummy_runs[0].commit.hash not in set(df.commit)
+
+
+def test_synced(
+    dummy_runs: List[Run], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    storage = Storage(tmp_path)
+    storage.store_runs(dummy_runs[:-1])
+
+    scans = []
+    orig_sources = Storage._sources
+
+    def sources(self: Storage) -> Dict[str, List[Any]]:
+        if self is storage:
+            scans.append(self)
+        return orig_sources(self)
+
+    monkeypatch.setattr(Storage, "_sources", sources)
+
+    with storage.synced():
+        for tip in storage.find_branch_tips().values():
+            assert len(list(storage.iterate(tip, limit=5))) == 5
+        storage.graph()
+        assert len(scans) == 1
+
+        # own writes update the column store, files changed behind its back
+        # are not picked up
+        storage.store_run(dummy_runs[-1])
+        assert dummy_runs[-1].commit.hash in storage.graph()
+        (tmp_path / Storage._make_filename(dummy_runs[0].commit)).unlink()
+        assert dummy_runs[0].commit.hash in storage.graph()
+        assert len(scans) == 1
+
+    assert dummy_runs[0].commit.hash not in storage.graph()
+    assert len(scans) == 2
+
+
+def test_dataframe_jobs(dummy_runs: List[Run], tmp_path: Path) -> None:
+    storage = Storage(tmp_path)
+    for run in dummy_runs:
+        storage.store_run(run)
+    exp = storage.dataframe()
+    shutil.rmtree(storage.columns.base_dir)
+
+    ticks = []
+    act = storage.dataframe(progress_callback=lambda: ticks.append(1), jobs=2)
+    assert len(ticks) == storage.num_runs()
+    pandas.testing.assert_frame_equal(exp, act)
+
+    # everything is covered now, the callback still ticks once per run
+    ticks.clear()
+    storage.dataframe(progress_callback=lambda: ticks.append(1), jobs=2)
+    assert len(ticks) == storage.num_runs()
+
+
+def test_column_chunks(dummy_runs: List[Run], tmp_path: Path) -> None:
+    storage = Storage(tmp_path)
+    dummy_runs[0].commit.message = "long message\n" * 1000
+    for run in dummy_runs:
+        storage.store_run(run)
+    # a commit that is already stored, its row is replaced
+    replaced = dummy_runs[10].copy(deep=True)
+    replaced.branch = "other"
+    storage.store_run(replaced)
+
+    # single row appends are merged into few chunks
+    chunks = storage.columns._read_meta()["chunks"]
+    assert sum(c["num_rows"] for c in chunks) == len(dummy_runs)
+    assert len(chunks) <= len(dummy_runs).bit_length()
+    # the long message does not pad the other rows
+    size = sum(f.stat().st_size for f in storage.columns.base_dir.rglob("*.bin"))
+    assert size < 2 * sum(len(r.commit.message.encode()) for r in dummy_runs)
+
+    exp = storage.dataframe()
+    shutil.rmtree(storage.columns.base_dir)
+    pandas.testing.assert_frame_equal(exp, storage.dataframe())
+    assert len(storage.columns._read_meta()["chunks"]) == 1
+
+
+def test_dataframe_backends(dummy_runs: List[Run], tmp_path: Path) -> None:
+    frames = []
+    for backend in StorageBackend:
+        storage_dir = tmp_path / backend.value
+        storage_dir.mkdir()
+        storage = make_storage(backend, storage_dir)
+        for run in dummy_runs:
+            storage.store_run(run)
+        frames.append(storage.dataframe().sort_values("commit", ignore_index=True))
+
+    for frame in frames[1:]:
+        pandas.testing.assert_frame_equal(frames[0], frame)
+
+
+def test_query(stored_runs: Storage) -> None:
+    df = stored_runs.dataframe()
+    pandas.testing.assert_frame_equal(stored_runs.query(), df)
+
+    act = stored_runs.query(metrics=["metric.b.gauss", "metric.a.uniform"])
+    pandas.testing.assert_frame_equal(
+        act,
+        df[list(df.columns[:5]) + ["metric.b.gauss", "metric.a.uniform"]],
+    )
+
+    act = stored_runs.query(branches=["feature"], limit_per_branch=10)
+    exp = df[df.branch == "feature"].head(10).reset_index(drop=True)
+    pandas.testing.assert_frame_equal(act, exp)
+
+    act = stored_runs.query(limit_per_branch=10, metrics=[])
+    assert list(act.branch.value_counts()) == [10, 10]
+    assert list(act.columns) == list(df.columns[:5])
+
+    since = df.date[df.branch == "main"].iloc[20]
+    act = stored_runs.query(since=since, branches=["main", "unknown"])
+    exp = df[(df.branch == "main") & (df.date >= since)].reset_index(drop=True)
+    assert len(act) == 21
+    pandas.testing.assert_frame_equal(act, exp)
+
+    act = stored_runs.query(since=since, limit_per_branch=5)
+    assert list(act.branch.value_counts()) == [5, 5]
+
+    with pytest.raises(KeyError):
+        stored_runs.query(metrics=["metric.unknown"])
+
+
+def test_compact(dummy_runs: List[Run], tmp_path: Path) -> None:
+    storage = SegmentStorage(tmp_path, segment_size=16 * 1024)
+    for run in dummy_runs:
+        storage.store_run(run)
+    assert len(storage._segments()) > 1
+    exp = storage.dataframe()
+
+    # store some runs a second time, superseding the first records
+    for run in dummy_runs[-10:]:
+        run2 = run.copy(deep=True)
+        storage._write_run(run2)
+    assert storage.num_runs() == len(dummy_runs)
+
+    assert storage.compact() == 10
+    assert storage.num_runs() == len(dummy_runs)
+    assert list(storage.iterate_all()) == sorted(
+        dummy_runs, key=lambda r: r.commit.hash
+    )
+    pandas.testing.assert_frame_equal(exp, storage.dataframe())
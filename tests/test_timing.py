@@ -0,0 +1,100 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from headwind.collector import run_collectors
+from headwind.report import make_report
+from headwind.spec import CollectorModel, CollectorResult, Metric, Spec
+from headwind.storage import Storage
+from headwind.test import generate_dummy_data
+from headwind.timing import current_timings, record, submit_timed, timed, timed_result
+
+
+def square(x: int) -> int:
+    with timed("square", "step"):
+        return x * x
+
+
+def test_timed(tmp_path: Path) -> None:
+    # nothing is recorded outside of record()
+    with timed("outside"):
+        pass
+
+    with record() as timings:
+        with timed("outer"):
+            with timed("inner", "step"):
+                sum(range(10000))
+            with timed("inner", "step"):
+                pass
+    assert current_timings.get() is None
+
+    assert [s.name for s in timings.spans] == ["inner", "inner", "outer"]
+    inner, _, outer = timings.spans
+    assert outer.start <= inner.start
+    assert outer.wall >= inner.wall >= 0
+
+    summary = timings.summary()
+    assert [row[:3] for row in summary] == [("phase", "outer", 1), ("step", "inner", 2)]
+
+    trace = tmp_path / "trace.json"
+    timings.write_trace(trace)
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert [e["name"] for e in events] == ["outer", "inner", "inner"]
+    assert events[0]["ts"] == 0
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+
+
+def test_timed_workers() -> None:
+    with ProcessPoolExecutor(max_workers=2) as ex:
+        # without timings, results come back as they are
+        assert timed_result(submit_timed(ex, square, 3)) == 9
+
+        with record() as timings:
+            futures = [submit_timed(ex, square, x) for x in range(4)]
+            assert [timed_result(f) for f in futures] == [0, 1, 4, 9]
+
+    names = sorted(s.name for s in timings.spans)
+    assert names == ["queued"] * 4 + ["square"] * 4
+
+
+def test_report_timings(tmp_path: Path) -> None:
+    spec_file = tmp_path / "spec.yml"
+    spec_file.write_text("")
+    spec = Spec(
+        collectors=[{"type": "command", "arg": "true"}],
+        spec_file=spec_file,
+        storage_dir="storage",
+        report_num_commits=20,
+    )
+    storage = Storage(spec.storage_dir)
+    for run in generate_dummy_data(42, 30, ["main"]):
+        storage.store_run(run)
+
+    output = tmp_path / "output"
+    output.mkdir()
+    with record() as timings:
+        make_report(spec, storage, output, jobs=2)
+
+    spans = {(s.category, s.name) for s in timings.spans}
+    assert {
+        ("phase", "query"),
+        ("phase", "scan sources"),
+        ("phase", "render"),
+        ("page", "index.html"),
+        ("page", "metric/group_a/metric.a.uniform/index.html"),
+        ("page", "metric/group_a/index.html"),
+        ("step", "template"),
+        ("step", "chart json"),
+        ("transfer", "queued"),
+    } <= spans
+
+
+def test_collector_timings() -> None:
+    result = CollectorResult(metrics=[Metric(name="a", value=1.0, unit="s")])
+    collectors = [
+        CollectorModel(type="command", arg=f"echo '{result.json()}'") for _ in range(2)
+    ]
+    with record() as timings:
+        assert run_collectors(collectors, jobs=2) == [result, result]
+
+    assert sorted(s.category for s in timings.spans) == ["collector"] * 2 + ["step"] * 2
@@ -0,0 +1,101 @@
+from pathlib import Path
+from typing import List
+
+import pandas
+import pytest
+
+from headwind.spec import Run, StorageBackend
+from headwind.storage import Storage
+from headwind.transfer import ExportFormat, export_runs, import_runs, read_runs
+
+from conftest import make_storage
+
+
+def test_store_runs(
+    dummy_runs: List[Run], storage_backend: StorageBackend, tmp_path: Path
+) -> None:
+    (tmp_path / "single").mkdir()
+    single = make_storage(storage_backend, tmp_path / "single")
+    for run in dummy_runs:
+        single.store_run(run.copy(deep=True))
+
+    (tmp_path / "batch").mkdir()
+    batch = make_storage(storage_backend, tmp_path / "batch")
+    batch.store_runs(dummy_runs[:10])
+    batch.store_runs([run.copy(deep=True) for run in dummy_runs[10:]])
+
+    assert list(batch.iterate_all()) == list(single.iterate_all())
+    assert batch.find_branch_tips() == single.find_branch_tips()
+    assert batch.catalog() == single.catalog()
+    pandas.testing.assert_frame_equal(batch.dataframe(), single.dataframe())
+
+
+def test_export_import(
+    stored_runs: Storage, storage_backend: StorageBackend, tmp_path: Path
+) -> None:
+    output = tmp_path / "runs.ndjson"
+    assert export_runs(stored_runs, output, ExportFormat.Ndjson, chunk_size=7) == 200
+
+    (tmp_path / "imported").mkdir()
+    storage = make_storage(storage_backend, tmp_path / "imported")
+    with output.open() as fh:
+        assert import_runs(storage, read_runs(fh)) == (200, 0)
+    with output.open() as fh:
+        assert import_runs(storage, read_runs(fh)) == (0, 200)
+
+    assert list(storage.iterate_all()) == list(stored_runs.iterate_all())
+    assert storage.find_branch_tips() == stored_runs.find_branch_tips()
+    pandas.testing.assert_frame_equal(storage.dataframe(), stored_runs.dataframe())
+
+
+def test_export_csv(stored_runs: Storage, tmp_path: Path) -> None:
+    output = tmp_path / "runs.csv"
+    assert export_runs(stored_runs, output, ExportFormat.Csv, chunk_size=30) == 200
+
+    df = pandas.read_csv(output)
+    exp = stored_runs.dataframe()
+    assert list(df.columns) == ["branch", "commit", "date", "parent", "message"] + [
+        m.name for ms in stored_runs.get_metrics().values() for m in ms
+    ]
+    df = df.set_index("commit").loc[exp.commit]
+    assert list(df.branch) == list(exp.branch)
+    assert df["metric.a.uniform"].to_numpy() == pytest.approx(
+        exp["metric.a.uniform"].to_numpy()
+    )
+
+
+def test_export_without_parsing(
+    stored_runs: Storage, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stored_runs.dataframe()
+
+    def fail(*args: object) -> None:
+        raise AssertionError("Runs were parsed")
+
+    # tables come from the columnar data
+    monkeypatch.setattr(Storage, "_read_run", staticmethod(fail))
+    monkeypatch.setattr(Storage, "_load_sources", fail)
+    output = tmp_path / "runs.csv"
+    assert export_runs(stored_runs, output, ExportFormat.Csv, chunk_size=30) == 200
+    assert len(pandas.read_csv(output)) == 200
+
+
+def test_export_parquet(stored_runs: Storage, tmp_path: Path) -> None:
+    pytest.importorskip("pyarrow")
+
+    output = tmp_path / "runs.parquet"
+    n = export_runs(stored_runs, output, ExportFormat.Parquet, chunk_size=30)
+    assert n == 200
+
+    df = pandas.read_parquet(output)
+    assert len(df) == 200
+    assert df.parent.isna().sum() == 2
+    assert str(df.date.dt.tz) == "UTC"
+
+
+def test_export_format_from_path() -> None:
+    assert ExportFormat.from_path(Path("a.parquet")) == ExportFormat.Parquet
+    assert ExportFormat.from_path(Path("a.CSV")) == ExportFormat.Csv
+    assert ExportFormat.from_path(Path("a.jsonl")) == ExportFormat.Ndjson
+    with pytest.raises(ValueError):
+        ExportFormat.from_path(Path("a.txt"))